@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Ipodify api benchmarks to be run as modules, like python -m benchmarks.track_filter."""
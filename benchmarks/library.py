@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Synthetic track libraries shared by the benchmarks."""
+import random
+
+from ipodify_api.model.track import SpotifyTrack
+
+
+ARTISTS = [f"Artist {i}" for i in range(2000)]
+ALBUMS = [f"Album {i}" for i in range(5000)]
+GENRES = ["pop", "rock", "indie rock", "spanish pop", "eurodance", "europop", "italo dance", "jazz", "latin",
+          "hip hop", "trap", "metal", "punk", "folk", "blues", "classical", "techno", "house", "reggaeton", "soul"]
+LANGUAGES = ["English", "Spanish", "French", "Unknown"]
+
+
+def random_track_dicts(size, seed=0):
+    """Get a list of size random Spotify track dicts that is always the same for the same seed."""
+    rnd = random.Random(seed)
+    track_dicts = []
+    for i in range(size):
+        track_id = f"{i:022d}"
+        track_dicts.append({
+            "uri": f"spotify:track:{track_id}",
+            "href": f"https://api.spotify.com/v1/tracks/{track_id}",
+            "name": f"Track {i}",
+            "isrc": f"ES{i:010d}",
+            "album": rnd.choice(ALBUMS),
+            "release_year": rnd.randint(1960, 2020),
+            "language": rnd.choice(LANGUAGES),
+            "artists": rnd.sample(ARTISTS, rnd.randint(1, 3)),
+            "genres": rnd.sample(GENRES, rnd.randint(0, 5))
+        })
+    return track_dicts
+
+
+def random_tracks(size, seed=0):
+    """Get a list of size random Spotify tracks that is always the same for the same seed."""
+    return [SpotifyTrack(**d) for d in random_track_dicts(size, seed)]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Compare evaluating the smart playlists of a user one by one against evaluating them together."""
+import sys
+import timeit
+
+from ipodify_api.model.library import TrackLibrary, TrackIndex
+from ipodify_api.model.planner import TrackFilterPlanner
+from ipodify_api.model.track import TrackFilter
+
+from .library import GENRES, LANGUAGES, random_tracks
+
+
+def playlist_filter_dicts():
+    """Get filters of smart playlists by decade, language and genre that share most of their subfilters."""
+    filter_dicts = []
+    for decade in range(1960, 2030, 10):
+        for language in LANGUAGES:
+            filter_dicts.append({"$and": [
+                {"$ge": {"release_year": decade}},
+                {"$lt": {"release_year": decade + 10}},
+                {"$eq": {"language": language}},
+                {"$not": {"$match": {"genres": "^.*(metal|punk).*$"}}}
+            ]})
+    for genre in GENRES:
+        filter_dicts.append({"$and": [
+            {"$eq": {"genres": genre}},
+            {"$not": {"$match": {"genres": "^.*(metal|punk).*$"}}}
+        ]})
+    return filter_dicts
+
+
+def main(sizes):
+    """Run benchmark for each library size."""
+    filter_dicts = playlist_filter_dicts()
+    for size in sizes:
+        tracks = random_tracks(size)
+        library = TrackLibrary(tracks)
+        planner = TrackFilterPlanner(library)
+        track_filters = [planner.plan(TrackFilter.fromDict(d)) for d in filter_dicts]
+        index = TrackIndex(library)
+        assert index.filter_many(track_filters) == [library.filter(f) for f in track_filters]
+
+        one_by_one_time = min(timeit.repeat(lambda: [index.filter(f) for f in track_filters], number=1, repeat=3))
+        batch_time = min(timeit.repeat(lambda: index.filter_many(track_filters), number=1, repeat=3))
+        print(f"{size:>7} tracks {len(track_filters)} playlists: one by one {one_by_one_time * 1000:8.1f} ms, "
+              f"batch {batch_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [10000, 100000])
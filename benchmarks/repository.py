@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Compare playlist imports and lookups in memory repositories with and without copies and secondary indexes."""
+import sys
+import timeit
+
+from ipodify_api.model.playlist import Playlist
+from ipodify_api.model.track import TrackPropertyFilter
+from ipodify_api.model.user import User
+from ipodify_api.repositories.memory import MemoryRepository
+
+
+PLAYLISTS_PER_USER = 10
+
+
+def main(sizes):
+    """Run benchmark for each number of users."""
+    for size in sizes:
+        users = [User(f"user{i}") for i in range(size)]
+        playlists = [Playlist(f"playlist{j}", u, TrackPropertyFilter("$eq", "album", f"Album {j}"))
+                     for u in users for j in range(PLAYLISTS_PER_USER)]
+        repositories = {
+            "scan": lambda: MemoryRepository(),
+            "indexed": lambda: MemoryRepository({Playlist: [("owner",), ("owner", "name")]}),
+            "no copy": lambda: MemoryRepository({Playlist: [("owner",), ("owner", "name")]}, copy=False)
+        }
+        for name, create_repository in repositories.items():
+            add_time = min(timeit.repeat(lambda: create_repository().add_many(playlists), number=1, repeat=3))
+            repository = create_repository()
+            repository.add_many(playlists)
+            user = users[size // 2]
+            owner_time = min(timeit.repeat(lambda: repository.find_by_filter(Playlist, {"owner": user}),
+                                           number=10, repeat=3)) / 10
+            name_time = min(timeit.repeat(
+                lambda: repository.find_by_filter(Playlist, {"owner": user, "name": "playlist5"}),
+                number=10, repeat=3)) / 10
+            print(f"{size:>7} users {name:>8}: add {add_time * 1000:8.1f} ms, owner {owner_time * 1000:8.3f} ms, "
+                  f"owner and name {name_time * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [1000, 10000])
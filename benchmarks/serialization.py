@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Compare the Flask JSON encoder of objects __dict__ against the serializers of synthetic library payloads."""
+import json
+import sys
+import timeit
+
+from ipodify_api import serializers
+
+from .library import random_tracks
+
+
+class DictJSONEncoder(json.JSONEncoder):
+    """JSON encoder of objects by their __dict__, as the application one used to be."""
+
+    def default(self, obj):
+        """Get default JSON Encode value."""
+        if hasattr(obj, '__dict__'):
+            return obj.__dict__
+        return obj
+
+
+def main(sizes):
+    """Run benchmark for each library size."""
+    orjson = serializers.orjson
+    for size in sizes:
+        payload = {"tracks": random_tracks(size)}
+        dict_time = min(timeit.repeat(lambda: json.dumps(payload, cls=DictJSONEncoder), number=1, repeat=3))
+        serializers.orjson = None
+        json_time = min(timeit.repeat(lambda: serializers.dumps(payload), number=1, repeat=3))
+        serializers.orjson = orjson
+        print(f"{size:>7} tracks: __dict__ encoder {dict_time * 1000:8.1f} ms, "
+              f"json serializer {json_time * 1000:8.1f} ms", end="")
+        if orjson is not None:
+            orjson_time = min(timeit.repeat(lambda: serializers.dumps(payload), number=1, repeat=3))
+            print(f", orjson serializer {orjson_time * 1000:8.1f} ms", end="")
+        print()
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [50000])
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Compare one by one against bulk and batched operations of SQL repositories over SQLite."""
+import sys
+import time
+
+from ipodify_api.model.playlist import Playlist
+from ipodify_api.model.track import TrackPropertyFilter
+from ipodify_api.model.user import User
+from ipodify_api.repositories.sql import SQLRepository, EntityMap
+
+
+PLAYLISTS_PER_USER = 10
+LOOKUPS = 1000
+
+
+def timed(function):
+    """Get seconds a function takes to run."""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def add_one_by_one(repository, entities):
+    """Add entities to the repository with a session add per entity, as the repository used to do."""
+    for entity in entities:
+        entity_map = EntityMap.get_map(entity.__class__)
+        repository.session.add(entity_map(**entity_map.to_values(entity)))
+    repository.session.flush()
+
+
+def main(sizes):
+    """Run benchmark for each number of playlists."""
+    for size in sizes:
+        users = [User(f"user{i}") for i in range(size // PLAYLISTS_PER_USER)]
+        playlists = [Playlist(f"playlist{j}", u, TrackPropertyFilter("$eq", "album", f"Album {j}"))
+                     for u in users for j in range(PLAYLISTS_PER_USER)]
+        ids = [p.id for p in playlists[::len(playlists) // LOOKUPS]]
+
+        one_by_one_repository = SQLRepository()
+        add_time = timed(lambda: add_one_by_one(one_by_one_repository, users + playlists))
+        find_time = timed(lambda: [one_by_one_repository.find_by_id(Playlist, i) for i in ids])
+        remove_time = timed(lambda: [one_by_one_repository.remove_by_id(Playlist, i) for i in ids])
+        print(f"{size:>7} playlists one by one: add {add_time * 1000:8.1f} ms, find {len(ids)} "
+              f"{find_time * 1000:8.1f} ms, remove {len(ids)} {remove_time * 1000:8.1f} ms")
+
+        bulk_repository = SQLRepository()
+        add_time = timed(lambda: bulk_repository.add_many(users + playlists))
+        find_time = timed(lambda: bulk_repository.find_by_ids(Playlist, ids))
+        remove_time = timed(lambda: bulk_repository.remove_by_ids(Playlist, ids))
+        print(f"{size:>7} playlists       bulk: add {add_time * 1000:8.1f} ms, find {len(ids)} "
+              f"{find_time * 1000:8.1f} ms, remove {len(ids)} {remove_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [100000])
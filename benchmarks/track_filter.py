@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Compare TrackFilter.match against compiled filters, columnar libraries and indexes over synthetic libraries."""
+import sys
+import timeit
+
+from ipodify_api.model.library import TrackLibrary, TrackIndex
+from ipodify_api.model.track import TrackFilter
+
+from .library import random_tracks
+
+
+FILTER_DICTS = {
+    "property": {"$eq": {"artists": "Artist 1"}},
+    "decade": {"$and": [{"$ge": {"release_year": 2000}}, {"$lt": {"release_year": 2010}}]},
+    "smart": {"$and": [
+        {"$or": [{"$match": {"genres": "^.*pop.*$"}}, {"$in": {"language": ["Spanish", "French"]}}]},
+        {"$not": {"$eq": {"album": "Album 1"}}},
+        {"$ge": {"release_year": 1990}}
+    ]}
+}
+
+
+def main(sizes):
+    """Run benchmark for each library size."""
+    for size in sizes:
+        tracks = random_tracks(size)
+        library = TrackLibrary(tracks)
+        index = TrackIndex(library)
+        for filter_name, filter_dict in FILTER_DICTS.items():
+            track_filter = TrackFilter.fromDict(filter_dict)
+            predicate = track_filter.compile()
+            assert [t for t in tracks if t.match_filter(track_filter)] == [t for t in tracks if predicate(t)]
+            assert library.filter(track_filter) == [t for t in tracks if predicate(t)]
+            assert index.filter(track_filter) == [t for t in tracks if predicate(t)]
+
+            match_time = min(timeit.repeat(lambda: [t for t in tracks if t.match_filter(track_filter)],
+                                           number=1, repeat=3))
+            compiled_time = min(timeit.repeat(lambda: [t for t in tracks if predicate(t)], number=1, repeat=3))
+            columnar_time = min(timeit.repeat(lambda: library.filter(track_filter), number=1, repeat=3))
+            indexed_time = min(timeit.repeat(lambda: index.filter(track_filter), number=1, repeat=3))
+            print(f"{size:>7} tracks {filter_name:>8}: match {match_time * 1000:8.1f} ms, "
+                  f"compiled {compiled_time * 1000:8.1f} ms, columnar {columnar_time * 1000:8.1f} ms, "
+                  f"indexed {indexed_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Measure memory used per track by synthetic libraries decoded from JSON as Spotify responses are."""
+import json
+import sys
+import tracemalloc
+
+from ipodify_api.model.track import SpotifyTrack
+
+from .library import random_track_dicts
+
+
+def main(sizes):
+    """Run benchmark for each library size."""
+    for size in sizes:
+        track_dicts_json = json.dumps(random_track_dicts(size))
+        tracemalloc.start()
+        track_dicts = json.loads(track_dicts_json)
+        tracks = [SpotifyTrack(**d) for d in track_dicts]
+        del track_dicts
+        used_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{len(tracks):>7} tracks: {used_memory / size:8.1f} bytes per track")
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [10000, 100000])
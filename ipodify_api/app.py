@@ -1,16 +1,38 @@
 # -*- coding: utf-8 -*-
 """Ipodify application."""
 import inject
+import os
 
 from json import JSONEncoder
 from flask import Flask
 from werkzeug.exceptions import HTTPException
 
-from .error import handle_http_exception
-from .gateways.spotify import SpotifyGateway
+from .cache import LRUCache, MetadataCache, LibrarySnapshotStore, SingleFlightTimeoutException
+from .error import handle_http_exception, handle_invalid_track_filter_exception, handle_invalid_cursor_exception, \
+                   handle_timeout_exception
+from .gateways.rate_limit import FileTokenBucket, RateLimitScheduler, TokenBucket
+from .gateways.spotify import SpotifyGateway, SpotifyUserCache
+from .model.library import InvalidCursorException
+from .model.playlist import Playlist
+from .model.track import InvalidTrackFilterDictException, InvalidFilterValueException
 from .repositories.memory import MemoryRepository
+from .serializers import to_primitive
 from .use_cases import GetFilterPreviewUseCase, GetLibraryUseCase, GetPlaylistsUseCase, \
-                       AddPlaylistUseCase, GetPlaylistUseCase, RemovePlaylistUseCase
+                       AddPlaylistUseCase, GetPlaylistUseCase, RemovePlaylistUseCase, GetPlaylistsTracksUseCase
+
+
+LIBRARY_CACHE_MAX_TRACKS = 1000000
+LIBRARY_CACHE_TTL = 60
+LIBRARY_FETCH_TIMEOUT = 60
+METADATA_CACHE_MAX_SIZE = 500000
+LIBRARY_STORE_MAX_SIZE = 10000
+# SQLite database where library snapshots and metadata are persisted between restarts, if set
+CACHE_PATH = os.environ.get('IPODIFY_CACHE_PATH')
+# Spotify requests per second and burst allowed to all the workers that share the rate limit file, if set
+SPOTIFY_RATE_LIMIT = 50
+SPOTIFY_RATE_LIMIT_BURST = 100
+RATE_LIMIT_PATH = os.environ.get('IPODIFY_RATE_LIMIT_PATH')
+REPOSITORY_INDEXES = {Playlist: [("owner",), ("owner", "name")]}
 
 
 class CustomJSONEncoder(JSONEncoder):
@@ -18,24 +40,32 @@ class CustomJSONEncoder(JSONEncoder):
 
     def default(self, obj):
         """Get default JSON Encode value."""
-        if hasattr(obj, '__dict__'):
-            return obj.__dict__
-        return obj
+        return to_primitive(obj)
 
 
 def app_config(binder):
     """Configure app inject bindings."""
-    spotify_gateway = SpotifyGateway()
-    repository = MemoryRepository()
-    get_library_use_case = GetLibraryUseCase(spotify_gateway)
+    if RATE_LIMIT_PATH is not None:
+        rate_limit_bucket = FileTokenBucket(RATE_LIMIT_PATH, SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_LIMIT_BURST)
+    else:
+        rate_limit_bucket = TokenBucket(SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_LIMIT_BURST)
+    spotify_gateway = SpotifyGateway(scheduler=RateLimitScheduler(rate_limit_bucket))
+    repository = MemoryRepository(REPOSITORY_INDEXES)
+    library_cache = LRUCache(LIBRARY_CACHE_MAX_TRACKS, weight=len)
+    metadata_cache = MetadataCache(METADATA_CACHE_MAX_SIZE, path=CACHE_PATH)
+    snapshot_store = LibrarySnapshotStore(CACHE_PATH, LIBRARY_STORE_MAX_SIZE) if CACHE_PATH is not None else None
+    get_library_use_case = GetLibraryUseCase(spotify_gateway, library_cache, LIBRARY_CACHE_TTL, metadata_cache,
+                                             snapshot_store, LIBRARY_FETCH_TIMEOUT)
 
     binder.bind(SpotifyGateway, spotify_gateway)
+    binder.bind(SpotifyUserCache, SpotifyUserCache())
     binder.bind(GetLibraryUseCase, get_library_use_case)
-    binder.bind(GetFilterPreviewUseCase, GetFilterPreviewUseCase(spotify_gateway))
+    binder.bind(GetFilterPreviewUseCase, GetFilterPreviewUseCase(get_library_use_case))
     binder.bind(GetPlaylistsUseCase, GetPlaylistsUseCase(repository))
     binder.bind(GetPlaylistUseCase, GetPlaylistUseCase(repository))
     binder.bind(AddPlaylistUseCase, AddPlaylistUseCase(repository))
     binder.bind(RemovePlaylistUseCase, RemovePlaylistUseCase(repository))
+    binder.bind(GetPlaylistsTracksUseCase, GetPlaylistsTracksUseCase(repository, get_library_use_case))
 
 
 def create_app(inject_config=app_config):
@@ -48,6 +78,10 @@ def create_app(inject_config=app_config):
         from . import routes
 
         app.register_error_handler(HTTPException, handle_http_exception)
+        app.register_error_handler(InvalidTrackFilterDictException, handle_invalid_track_filter_exception)
+        app.register_error_handler(InvalidFilterValueException, handle_invalid_track_filter_exception)
+        app.register_error_handler(InvalidCursorException, handle_invalid_cursor_exception)
+        app.register_error_handler(SingleFlightTimeoutException, handle_timeout_exception)
         app.register_blueprint(routes.api)
 
         return app
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Caches shared between requests."""
+import json
+import sqlite3
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from threading import Lock, RLock
+
+# Maximum number of key values per statement, so statements stay below the SQLite limit of 999 variables
+SQL_BATCH_SIZE = 500
+
+
+class SingleFlightTimeoutException(Exception):
+    """Exception raised when a call in flight takes longer than the time its callers wait for it."""
+
+    pass
+
+
+class LRUCache(object):
+    """Thread safe cache that evicts least recently used values when its size is exceeded.
+
+    The size of each value is given by the weight function, by default every value weights one. If a ttl in seconds is
+    set values older than it are discarded when requested.
+    """
+
+    def __init__(self, max_size, ttl=None, weight=None, clock=time.monotonic):
+        """Create LRU cache."""
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__weight = weight if weight is not None else lambda value: 1
+        self.__clock = clock
+        self.__values = OrderedDict()
+        self.__size = 0
+        self.__lock = RLock()
+
+    @property
+    def max_size(self):
+        """Get maximum size of the cache."""
+        return self.__max_size
+
+    @property
+    def ttl(self):
+        """Get seconds values are kept in the cache."""
+        return self.__ttl
+
+    @property
+    def size(self):
+        """Get current size of the cache."""
+        return self.__size
+
+    def __len__(self):
+        """Get number of values in the cache."""
+        return len(self.__values)
+
+    def __contains__(self, key):
+        """Return if the cache contains a not expired value for the key."""
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        """Get cached value of a key or default if it is not cached or has expired."""
+        with self.__lock:
+            if key not in self.__values:
+                return default
+            value, weight, stored_at = self.__values[key]
+            if self.__ttl is not None and self.__clock() - stored_at >= self.__ttl:
+                self.pop(key)
+                return default
+            self.__values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Set cached value of a key evicting least recently used values if required."""
+        weight = self.__weight(value)
+        with self.__lock:
+            self.pop(key)
+            if weight > self.__max_size:
+                return
+            self.__values[key] = (value, weight, self.__clock())
+            self.__size += weight
+            while self.__size > self.__max_size:
+                _, (_, evicted_weight, _) = self.__values.popitem(last=False)
+                self.__size -= evicted_weight
+
+    def pop(self, key, default=None):
+        """Remove a key from the cache and return its value."""
+        with self.__lock:
+            if key not in self.__values:
+                return default
+            value, weight, _ = self.__values.pop(key)
+            self.__size -= weight
+            return value
+
+    def clear(self):
+        """Remove all values from the cache."""
+        with self.__lock:
+            self.__values.clear()
+            self.__size = 0
+
+
+class MetadataCache(object):
+    """Cache of Spotify objects metadata by its kind and id shared between all users.
+
+    Values are kept in memory in a LRU cache per kind and, if a path is provided, they are also persisted in a SQLite
+    database so they survive restarts.
+    """
+
+    def __init__(self, max_size=100000, ttl=7 * 24 * 60 * 60, path=None):
+        """Create metadata cache."""
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__caches = {}
+        self.__lock = RLock()
+        self.__connection = None
+        if path is not None:
+            self.__connection = sqlite3.connect(path, check_same_thread=False)
+            with self.__connection:
+                self.__connection.execute("CREATE TABLE IF NOT EXISTS metadata (kind TEXT, id TEXT, value TEXT, "
+                                          "stored_at REAL, PRIMARY KEY (kind, id))")
+
+    def __cache(self, kind):
+        with self.__lock:
+            if kind not in self.__caches:
+                self.__caches[kind] = LRUCache(self.__max_size, self.__ttl)
+            return self.__caches[kind]
+
+    def __load(self, kind, ids):
+        """Load persisted not expired values of a kind by its ids."""
+        values = {}
+        with self.__lock:
+            for i in range(0, len(ids), SQL_BATCH_SIZE):
+                chunk_ids = ids[i:i + SQL_BATCH_SIZE]
+                rows = self.__connection.execute(
+                    "SELECT id, value FROM metadata WHERE kind = ? AND stored_at > ? "
+                    f"AND id IN ({','.join('?' * len(chunk_ids))})",
+                    [kind, time.time() - self.__ttl] + chunk_ids)
+                values.update({_id: json.loads(value) for _id, value in rows})
+        return values
+
+    def get_many(self, kind, ids):
+        """Get dict with the cached values of a kind for the ids that are in the cache."""
+        cache = self.__cache(kind)
+        values = {}
+        for _id in ids:
+            value = cache.get(_id)
+            if value is not None:
+                values[_id] = value
+        if self.__connection is not None:
+            missing_ids = [i for i in ids if i not in values]
+            if missing_ids:
+                persisted_values = self.__load(kind, missing_ids)
+                for _id, value in persisted_values.items():
+                    cache.set(_id, value)
+                values.update(persisted_values)
+        return values
+
+    def set_many(self, kind, values):
+        """Set values of a kind from a dict by their ids."""
+        cache = self.__cache(kind)
+        for _id, value in values.items():
+            cache.set(_id, value)
+        if self.__connection is not None and values:
+            stored_at = time.time()
+            with self.__lock, self.__connection:
+                self.__connection.executemany(
+                    "INSERT OR REPLACE INTO metadata (kind, id, value, stored_at) VALUES (?, ?, ?, ?)",
+                    [(kind, _id, json.dumps(value), stored_at) for _id, value in values.items()])
+
+
+class LibrarySnapshotStore(object):
+    """Store of user libraries persisted in a SQLite database, so they survive restarts.
+
+    Each library is stored as its version, etag, fetch timestamp and the rows of its tracks in library order, with the
+    key and the serialized track of each of them. Libraries are loaded when they are requested, not when the store is
+    created, and when a library changes only the rows added and removed since the stored version are written. If the
+    number of stored libraries exceeds the max size the ones fetched longest ago are removed.
+    """
+
+    def __init__(self, path, max_size=10000):
+        """Create library snapshot store."""
+        self.__max_size = max_size
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS libraries (user TEXT PRIMARY KEY, version TEXT, "
+                                      "etag TEXT, fetched_at REAL, first_rank INTEGER)")
+            # Rows are sorted by rank, and rows added before the rest get lower ranks, so no other row is updated
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS library_tracks (user TEXT, key TEXT, rank INTEGER, "
+                                      "track TEXT, PRIMARY KEY (user, key))")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS library_tracks_rank ON library_tracks (user, rank)")
+
+    @property
+    def max_size(self):
+        """Get maximum number of stored libraries."""
+        return self.__max_size
+
+    def get(self, user_name):
+        """Get tuple with the version, etag, fetch timestamp and rows of a user library or None if it is not stored."""
+        with self.__lock:
+            library = self.__connection.execute(
+                "SELECT version, etag, fetched_at FROM libraries WHERE user = ?", [user_name]).fetchone()
+            if library is None:
+                return None
+            rows = self.__connection.execute(
+                "SELECT key, track FROM library_tracks WHERE user = ? ORDER BY rank", [user_name]).fetchall()
+        return library + (rows,)
+
+    def set(self, user_name, version, etag, fetched_at, rows):
+        """Store a user library replacing the stored one."""
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM library_tracks WHERE user = ?", [user_name])
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO libraries (user, version, etag, fetched_at, first_rank) VALUES (?, ?, ?, ?, 0)",
+                [user_name, version, etag, fetched_at])
+            self.__connection.executemany(
+                "INSERT INTO library_tracks (user, key, rank, track) VALUES (?, ?, ?, ?)",
+                [(user_name, key, rank, track) for rank, (key, track) in enumerate(rows)])
+            self.__evict()
+
+    def update(self, user_name, base_version, version, etag, fetched_at, added_rows=(), removed_keys=()):
+        """Store the changes of a user library since the stored version and return if it was stored.
+
+        If the stored library already is the version only its etag and fetch timestamp are updated. Otherwise, if the
+        stored library is the base version, the added rows are stored before the rest and the rows of the removed
+        keys are deleted. Nothing is stored if the stored library is neither of them.
+        """
+        with self.__lock, self.__connection:
+            library = self.__connection.execute(
+                "SELECT version, first_rank FROM libraries WHERE user = ?", [user_name]).fetchone()
+            if library is None or (library[0] != version and (base_version is None or library[0] != base_version)):
+                return False
+            first_rank = library[1]
+            if library[0] != version:
+                removed_keys = list(removed_keys)
+                for i in range(0, len(removed_keys), SQL_BATCH_SIZE):
+                    chunk_keys = removed_keys[i:i + SQL_BATCH_SIZE]
+                    self.__connection.execute(
+                        f"DELETE FROM library_tracks WHERE user = ? AND key IN ({','.join('?' * len(chunk_keys))})",
+                        [user_name] + chunk_keys)
+                added_rows = list(added_rows)
+                first_rank -= len(added_rows)
+                self.__connection.executemany(
+                    "INSERT OR REPLACE INTO library_tracks (user, key, rank, track) VALUES (?, ?, ?, ?)",
+                    [(user_name, key, first_rank + i, track) for i, (key, track) in enumerate(added_rows)])
+            self.__connection.execute(
+                "UPDATE libraries SET version = ?, etag = ?, fetched_at = ?, first_rank = ? WHERE user = ?",
+                [version, etag, fetched_at, first_rank, user_name])
+            return True
+
+    def pop(self, user_name):
+        """Remove stored library of a user."""
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM library_tracks WHERE user = ?", [user_name])
+            self.__connection.execute("DELETE FROM libraries WHERE user = ?", [user_name])
+
+    def __evict(self):
+        """Remove the libraries fetched longest ago while there are more than the max size."""
+        evicted_users = "SELECT user FROM libraries ORDER BY fetched_at DESC LIMIT -1 OFFSET ?"
+        self.__connection.execute(f"DELETE FROM library_tracks WHERE user IN ({evicted_users})", [self.__max_size])
+        self.__connection.execute(f"DELETE FROM libraries WHERE user IN ({evicted_users})", [self.__max_size])
+
+
+class SingleFlight(object):
+    """Run a function once at a time per key, sharing its result or error with the callers that arrive meanwhile.
+
+    If a timeout in seconds is set, callers waiting for a call in flight raise SingleFlightTimeoutException when it
+    takes longer than that, while the call itself goes on for its own caller.
+    """
+
+    def __init__(self, timeout=None):
+        """Create single flight."""
+        self.__timeout = timeout
+        self.__calls = {}
+        self.__lock = Lock()
+
+    @property
+    def timeout(self):
+        """Get seconds callers wait for a call in flight."""
+        return self.__timeout
+
+    def in_flight(self, key):
+        """Return if there is a call in flight for the key."""
+        with self.__lock:
+            return key in self.__calls
+
+    def start(self, key):
+        """Start a call for the key unless there is one in flight, and get its future and if it was started.
+
+        The caller that starts a call must finish it, even if it fails, so the callers waiting for it get its result.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            if call is not None:
+                return call, False
+            call = self.__calls[key] = Future()
+            return call, True
+
+    def finish(self, key, result=None, error=None):
+        """Finish the call in flight for the key with its result or error."""
+        with self.__lock:
+            call = self.__calls.pop(key)
+        if error is not None:
+            call.set_exception(error)
+        else:
+            call.set_result(result)
+
+    def wait(self, call):
+        """Wait for a call started by other caller and get its result."""
+        try:
+            call.exception(self.__timeout)
+        except TimeoutError:
+            raise SingleFlightTimeoutException("Timed out waiting for other request")
+        return call.result()
+
+    def do(self, key, function, *args, **kwargs):
+        """Call function for the key or wait for the call already in flight for it and get its result."""
+        call, leader = self.start(key)
+        if not leader:
+            return self.wait(call)
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
@@ -9,6 +9,21 @@ def handle_http_exception(e):
     return _jsonify_error(message=e.name, status_code=e.code), e.code
 
 
+def handle_invalid_track_filter_exception(e):
+    """Return json output of a track filter that could not be created."""
+    return _jsonify_error(message=str(e), status_code=400), 400
+
+
+def handle_invalid_cursor_exception(e):
+    """Return json output of a page cursor that is not valid for the library."""
+    return _jsonify_error(message=str(e), status_code=400), 400
+
+
+def handle_timeout_exception(e):
+    """Return json output of a request that timed out waiting for other request."""
+    return _jsonify_error(message="Gateway Timeout", status_code=504), 504
+
+
 def abort_with_message(message, status_code):
     """Abort with specific message format."""
     return abort(make_response(_jsonify_error(message, status_code), status_code))
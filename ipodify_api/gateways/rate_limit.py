@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Rate limits shared by the requests to external services."""
+import heapq
+import os
+import struct
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from threading import Condition, Lock
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover
+    fcntl = None
+
+
+INTERACTIVE_PRIORITY = 0
+BACKGROUND_PRIORITY = 10
+
+request_priority = ContextVar('request_priority', default=INTERACTIVE_PRIORITY)
+
+
+@contextmanager
+def priority(value):
+    """Set priority of the requests done in the context, lower values are served first."""
+    token = request_priority.set(value)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class RaisablePriority(object):
+    """Priority that can be raised while the requests done with it wait for a token.
+
+    It can be set as the request priority of a context instead of a value, like for requests done ahead of time
+    that have to be served sooner once their result is needed.
+    """
+
+    def __init__(self, value):
+        """Create raisable priority with an initial value."""
+        self.__value = value
+        self.__tickets = []
+        self.__lock = Lock()
+
+    @property
+    def value(self):
+        """Get current priority value."""
+        return self.__value
+
+    def _ticket(self, scheduler, sequence):
+        """Get ticket of a request that waits in a scheduler, whose priority is raised along with this one."""
+        with self.__lock:
+            ticket = [self.__value, sequence]
+            self.__tickets.append((scheduler, ticket))
+            return ticket
+
+    def _remove_ticket(self, ticket):
+        """Stop raising the priority of a ticket that no longer waits."""
+        with self.__lock:
+            self.__tickets = [(s, t) for s, t in self.__tickets if t is not ticket]
+
+    def raise_to(self, value):
+        """Raise priority to a lower value, also of the requests already waiting with it."""
+        with self.__lock:
+            if value >= self.__value:
+                return
+            self.__value = value
+            tickets = list(self.__tickets)
+        for scheduler, ticket in tickets:
+            scheduler._raise_ticket(ticket, value)
+
+
+class TokenBucket(object):
+    """Thread safe token bucket that gives up to rate tokens per second with bursts of up to capacity tokens.
+
+    If no rate is set tokens are unlimited. All tokens can be paused for some time, for example when the rate limited
+    service asks to retry later.
+    """
+
+    def __init__(self, rate=None, capacity=None, clock=time.monotonic):
+        """Create token bucket."""
+        self.__rate = rate
+        self.__capacity = capacity if capacity is not None else max(rate or 1, 1)
+        self.__clock = clock
+        self.__state = self._initial_state()
+        self.__lock = Lock()
+
+    @property
+    def rate(self):
+        """Get tokens given per second."""
+        return self.__rate
+
+    @property
+    def capacity(self):
+        """Get maximum number of tokens the bucket holds."""
+        return self.__capacity
+
+    @property
+    def tokens(self):
+        """Get number of tokens currently available."""
+        with self._state() as state:
+            self.__refill(state, self.__clock())
+            return state[0]
+
+    def _initial_state(self):
+        """Get list with the available tokens, the time they were refilled and the time tokens are paused until."""
+        return [float(self.__capacity), self.__clock(), 0.0]
+
+    @contextmanager
+    def _state(self):
+        """Get bucket state to read and update it exclusively."""
+        with self.__lock:
+            yield self.__state
+
+    def __refill(self, state, now):
+        if self.__rate is not None:
+            state[0] = min(float(self.__capacity), state[0] + max(now - state[1], 0) * self.__rate)
+        state[1] = now
+
+    def reserve(self):
+        """Take a token and return 0 or, if there is none available, return seconds to wait for the next one."""
+        with self._state() as state:
+            now = self.__clock()
+            if now < state[2]:
+                return state[2] - now
+            if self.__rate is None:
+                return 0
+            self.__refill(state, now)
+            if state[0] >= 1:
+                state[0] -= 1
+                return 0
+            return (1 - state[0]) / self.__rate
+
+    def pause(self, seconds):
+        """Pause all tokens for some seconds."""
+        with self._state() as state:
+            state[2] = max(state[2], self.__clock() + seconds)
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket whose state is kept in a local file, so it is shared by all the processes that use the file."""
+
+    STATE_FORMAT = "ddd"
+
+    def __init__(self, path, rate=None, capacity=None):
+        """Create file token bucket."""
+        if fcntl is None:     # pragma: no cover
+            raise RuntimeError("File token buckets require fcntl")
+        self.__path = path
+        self.__lock = Lock()
+        super().__init__(rate, capacity, time.time)
+
+    @contextmanager
+    def _state(self):
+        """Get bucket state from the file to read and update it exclusively, and write it back afterwards."""
+        size = struct.calcsize(self.STATE_FORMAT)
+        with self.__lock, open(os.open(self.__path, os.O_RDWR | os.O_CREAT), 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            data = f.read(size)
+            state = list(struct.unpack(self.STATE_FORMAT, data)) if len(data) == size else self._initial_state()
+            yield state
+            f.seek(0)
+            f.write(struct.pack(self.STATE_FORMAT, *state))
+
+
+class RateLimitScheduler(object):
+    """Scheduler that gives the tokens of a bucket to the requests waiting for them in order of priority.
+
+    Requests with the same priority are served in the order they arrive. The priority of a request is taken from the
+    request_priority context variable if it is not given, and if it is a raisable priority the request is served
+    sooner when it is raised.
+
+    Only the first request in the queue takes tokens from the bucket, and it does it without holding the scheduler
+    lock, so buckets that wait for a file lock do not block the rest of requests meanwhile.
+    """
+
+    def __init__(self, bucket=None):
+        """Create rate limit scheduler."""
+        self.__bucket = bucket if bucket is not None else TokenBucket()
+        self.__queue = []
+        self.__sequence = count()
+        self.__condition = Condition()
+        self.__acquired = 0
+        self.__throttled = 0
+        self.__reserving = False
+
+    @property
+    def bucket(self):
+        """Get token bucket."""
+        return self.__bucket
+
+    @property
+    def queue_depth(self):
+        """Get number of requests waiting for a token."""
+        return len(self.__queue)
+
+    @property
+    def stats(self):
+        """Get statistics of the requests scheduled."""
+        with self.__condition:
+            return {
+                'queued': len(self.__queue),
+                'queued_by_priority': dict(Counter(p for p, _ in self.__queue)),
+                'acquired': self.__acquired,
+                'throttled': self.__throttled
+            }
+
+    def acquire(self, priority=None):
+        """Wait until a request can be done."""
+        if priority is None:
+            priority = request_priority.get()
+        with self.__condition:
+            if isinstance(priority, RaisablePriority):
+                ticket = priority._ticket(self, next(self.__sequence))
+            else:
+                ticket = [priority, next(self.__sequence)]
+            heapq.heappush(self.__queue, ticket)
+            try:
+                while True:
+                    if self.__queue[0] is not ticket or self.__reserving:
+                        self.__condition.wait()
+                        continue
+                    self.__reserving = True
+                    self.__condition.release()
+                    try:
+                        wait = self.__bucket.reserve()
+                    finally:
+                        self.__condition.acquire()
+                        self.__reserving = False
+                    if not wait:
+                        self.__acquired += 1
+                        return
+                    self.__condition.notify_all()
+                    self.__condition.wait(wait)
+            finally:
+                self.__queue.remove(ticket)
+                heapq.heapify(self.__queue)
+                self.__condition.notify_all()
+                if isinstance(priority, RaisablePriority):
+                    priority._remove_ticket(ticket)
+
+    def _raise_ticket(self, ticket, priority):
+        """Raise priority of a ticket if it is still waiting."""
+        with self.__condition:
+            if any(t is ticket for t in self.__queue):
+                ticket[0] = min(ticket[0], priority)
+                heapq.heapify(self.__queue)
+                self.__condition.notify_all()
+
+    def retry_after(self, seconds):
+        """Pause requests after the service rate limit has been exceeded."""
+        with self.__condition:
+            self.__throttled += 1
+            self.__bucket.pause(seconds)
+            self.__condition.notify_all()
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 """Ports required by ipodify api service."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from flask import request
 from functools import wraps
+from itertools import islice
 
+from ..cache import LRUCache, SingleFlight
 from ..model import Hasheable
 from ..model.user import User
+from .rate_limit import BACKGROUND_PRIORITY, RaisablePriority, RateLimitScheduler, request_priority
 
+import hashlib
 import requests
 
+from requests.adapters import HTTPAdapter
+
 
 class SpotifyNotAuthenticatedError(Exception):
     """Error returned when not authenticated to Spotify or with invalid access token."""
@@ -29,14 +38,54 @@ class SpotifyUser(User):
         return self.__authorization
 
 
-def spotify_auth(spotify_gateway):
+class SpotifyUserCache(object):
+    """Cache of the Spotify user of each authorization header.
+
+    Headers are stored hashed, not authenticated headers are also cached for a shorter time and only one request to
+    Spotify is done at a time for the same header.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, not_authenticated_ttl=10):
+        """Create Spotify user cache."""
+        self.__users = LRUCache(max_size, ttl)
+        self.__not_authenticated = LRUCache(max_size, not_authenticated_ttl)
+        self.__single_flight = SingleFlight()
+
+    @staticmethod
+    def __key(authorization):
+        return hashlib.sha256(authorization.encode()).hexdigest()
+
+    def __load_user(self, key, authorization, get_user):
+        try:
+            spotify_user = get_user(authorization)
+        except SpotifyNotAuthenticatedError:
+            self.__not_authenticated.set(key, True)
+            raise
+        self.__users.set(key, spotify_user)
+        return spotify_user
+
+    def get_user(self, authorization, get_user):
+        """Get Spotify user of an authorization header, obtaining it with get user function if it is not cached."""
+        key = self.__key(authorization)
+        spotify_user = self.__users.get(key)
+        if spotify_user is not None:
+            return spotify_user
+        if key in self.__not_authenticated:
+            raise SpotifyNotAuthenticatedError()
+        return self.__single_flight.do(key, self.__load_user, key, authorization, get_user)
+
+
+def spotify_auth(spotify_gateway, spotify_user_cache=None):
     """Get requests SpotifyUser to be injected in the request handler."""
     def caller(func):
         @wraps(func)
         def wrapper(*kargs, **kwargs):
             authorization = request.headers.get('Authorization', '')
             try:
-                spotify_user = spotify_gateway.get_user(authorization)
+                if spotify_user_cache is None:
+                    spotify_user = spotify_gateway.get_user(authorization)
+                else:
+                    spotify_user = spotify_user_cache.get_user(authorization, spotify_gateway.get_user)
             except SpotifyNotAuthenticatedError:
                 return {"message": "Not authenticated or authorization"}, 401
             return func(spotify_user, *kargs, **kwargs)
@@ -47,37 +96,162 @@ def spotify_auth(spotify_gateway):
 class SpotifyGateway(object):
     """Port to interact with Spotify service."""
 
-    def __init__(self, url="https://api.spotify.com"):
-        """Create a Spotify port with specific url."""
+    def __init__(self, url="https://api.spotify.com", max_workers=8, max_retries=3, pool_size=None,
+                 timeout=(3.05, 10), scheduler=None):
+        """Create a Spotify port with specific url.
+
+        Library pages and batches of albums and artists are requested in parallel by up to max workers threads, and
+        requests that exceed Spotify rate limits are retried up to max retries times after the time Spotify asks to
+        wait.
+
+        Every request waits for its turn in a rate limit scheduler, that can be shared with other gateways, so when
+        Spotify asks to wait all requests wait instead of exceeding its rate limits again. Requests done by the
+        workers keep the priority of the request that started them, except prefetched library pages, which are
+        requested with background priority until they are the next page needed.
+
+        Requests are sent through a session that keeps alive up to pool size connections per host, by default one per
+        worker plus one, with a connect and read timeout in seconds.
+        """
         self.__url = url
+        self.__max_retries = max_retries
+        self.__max_workers = max_workers
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.__timeout = timeout
+        self.__scheduler = scheduler if scheduler is not None else RateLimitScheduler()
+        self.__adapter = HTTPAdapter(pool_maxsize=pool_size or max_workers + 1)
+        self.__session = requests.Session()
+        self.__session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.__session.mount('http://', self.__adapter)
+        self.__session.mount('https://', self.__adapter)
 
     @property
     def url(self):
         """Return Spotify url used."""
         return self.__url
 
+    @property
+    def pool_stats(self):
+        """Get statistics of the connection pool of each host.
+
+        The queue of a pool is filled with None until its connections are opened, so only the connections in it are
+        counted as idle.
+        """
+        pools = self.__adapter.poolmanager.pools
+        stats = []
+        for key in pools.keys():
+            pool = pools[key]
+            stats.append({
+                'host': pool.host,
+                'port': pool.port,
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': sum(c is not None for c in list(pool.pool.queue)) if pool.pool is not None else 0
+            })
+        return stats
+
+    @property
+    def scheduler(self):
+        """Get rate limit scheduler of the requests."""
+        return self.__scheduler
+
+    def __submit(self, function, *args, priority=None):
+        """Run function in a worker within the context of the caller, with other request priority if provided."""
+        context = copy_context()
+        if priority is not None:
+            context.run(request_priority.set, priority)
+        return self.__executor.submit(context.run, function, *args)
+
+    def _get(self, url, headers):
+        """Get url response retrying it while Spotify rate limits are exceeded."""
+        for attempt in range(self.__max_retries + 1):
+            self.__scheduler.acquire()
+            response = self.__session.get(url, headers=headers, timeout=self.__timeout)
+            if response.status_code != 429 or attempt == self.__max_retries:
+                return response
+            self.__scheduler.retry_after(float(response.headers.get('Retry-After', 1)))
+
+    def _get_content(self, url, headers):
+        """Get url json content raising an error if the request fails."""
+        response = self._get(url, headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _get_batches(self, spotify_user, path, key, ids, limit):
+        """Get Spotify objects by its ids in parallel batches of limit ids, keeping the order of the ids."""
+        authorization_header = {'Authorization': spotify_user.authorization}
+        request_urls = [f"{self.__url}{path}?ids={','.join(ids[i:i + limit])}" for i in range(0, len(ids), limit)]
+        for response in [self.__submit(self._get_content, u, authorization_header) for u in request_urls]:
+            yield from response.result().get(key)
+
     def get_user(self, authorization):
         """Get SpotifyUser."""
         authorization_header = {'Authorization': authorization}
         me = f"{self.__url}/v1/me"
-        r = requests.get(me, headers=authorization_header)
+        r = self._get(me, headers=authorization_header)
         if r.status_code == 401:
             raise SpotifyNotAuthenticatedError()
         r.raise_for_status()
         return SpotifyUser(r.json()['id'], authorization)
 
+    def get_library_page(self, spotify_user, offset=0, limit=50, etag=None):
+        """Get a page of Spotify user saved tracks and its ETag.
+
+        Saved tracks are returned newest first. If an etag is provided and the page has not changed since then, no
+        page content is returned.
+        """
+        headers = {'Authorization': spotify_user.authorization}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        response = self._get(f"{self.__url}/v1/me/tracks?offset={offset}&limit={limit}", headers)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
+    def get_library_items(self, spotify_user, first_page=None):
+        """Get Spotify user saved tracks items, with the track and the date it was added.
+
+        Once the first page is obtained the offsets of the rest of pages are known from its total, so they are
+        requested in parallel by the workers ahead of the page being consumed. Those pages may not be consumed, like
+        when only the newest tracks of the library are refreshed, so they are requested with background priority and
+        do not delay the requests other users are waiting for, until each one is the next page needed and its
+        priority is raised to the one of the caller. Pages that are not requested yet when the items stop being
+        consumed are cancelled. If the first page has already been obtained it can be provided to not request it
+        again.
+        """
+        limit = 50
+        page = first_page
+        if page is None:
+            page, _ = self.get_library_page(spotify_user, 0, limit)
+        yield from page.get('items')
+        if page.get('next') is None or not page.get('items'):
+            return
+
+        caller_priority = request_priority.get()
+        offsets = iter(range(page.get('offset', 0) + len(page.get('items')), page.get('total'), limit))
+        pending_pages = deque(self.__submit_library_page(spotify_user, offset, limit)
+                              for offset in islice(offsets, self.__max_workers))
+        try:
+            while pending_pages:
+                page_priority, pending_page = pending_pages.popleft()
+                page_priority.raise_to(caller_priority)
+                page, _ = pending_page.result()
+                for offset in islice(offsets, 1):
+                    pending_pages.append(self.__submit_library_page(spotify_user, offset, limit))
+                yield from page.get('items')
+        finally:
+            for _, pending_page in pending_pages:
+                pending_page.cancel()
+
+    def __submit_library_page(self, spotify_user, offset, limit):
+        """Request a library page in a worker with background priority, returning the priority to raise it."""
+        page_priority = RaisablePriority(BACKGROUND_PRIORITY)
+        return page_priority, self.__submit(self.get_library_page, spotify_user, offset, limit, priority=page_priority)
+
     def get_library_tracks(self, spotify_user):
         """Get Spotify user tracks in library."""
-        authorization_header = {'Authorization': spotify_user.authorization}
-        limit = 50
-        next_page_url = f"{self.__url}/v1/me/tracks?offset=0&limit={limit}"
-        while next_page_url is not None:
-            response = requests.get(next_page_url, headers=authorization_header)
-            response.raise_for_status()
-            response_content = response.json()
-            next_page_url = response_content.get('next', None)
-            for item in response_content.get('items'):
-                yield item.get('track')
+        for item in self.get_library_items(spotify_user):
+            yield item.get('track')
 
     def get_album(self, spotify_user, album_id):
         """Get an album with Spotify user credentials."""
@@ -85,15 +259,7 @@ class SpotifyGateway(object):
 
     def get_albums(self, spotify_user, album_ids):
         """Get multiple albums with Spotify user credentials."""
-        authorization_header = {'Authorization': spotify_user.authorization}
-        limit = 20
-        for album_set_ids in (album_ids[i:i + limit] for i in range(0, len(album_ids), limit)):
-            request_url = f"{self.__url}/v1/albums?ids={','.join(album_set_ids)}"
-            response = requests.get(request_url, headers=authorization_header)
-            response.raise_for_status()
-            response_content = response.json()
-            for item in response_content.get('albums'):
-                yield item
+        return self._get_batches(spotify_user, "/v1/albums", 'albums', album_ids, 20)
 
     def get_artist(self, spotify_user, artist_id):
         """Get an artist with Spotify user credentials."""
@@ -101,12 +267,4 @@ class SpotifyGateway(object):
 
     def get_artists(self, spotify_user, artist_ids):
         """Get multiple artists with Spotify user credentials."""
-        authorization_header = {'Authorization': spotify_user.authorization}
-        limit = 50
-        for artist_set_ids in (artist_ids[i:i + limit] for i in range(0, len(artist_ids), limit)):
-            request_url = f"{self.__url}/v1/artists?ids={','.join(artist_set_ids)}"
-            response = requests.get(request_url, headers=authorization_header)
-            response.raise_for_status()
-            response_content = response.json()
-            for item in response_content.get('artists'):
-                yield item
+        return self._get_batches(spotify_user, "/v1/artists", 'artists', artist_ids, 50)
@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""Track library model objects package."""
+import base64
+import hashlib
+import json
+import numbers
+import time
+
+import numpy as np
+
+from .track import TrackPropertyFilter, TrackAggregateFilter, TrackNotFilter
+
+
+class InvalidCursorException(Exception):
+    """Exception raised when a page cursor is not valid for a library snapshot."""
+
+    pass
+
+
+MULTI_VALUED_PROPERTIES = ["artists", "genres"]
+NUMERIC_PROPERTIES = ["release_year"]
+# Previous versions of a library whose changes are kept in its snapshots
+MAX_SNAPSHOT_DELTAS = 8
+NUMERIC_COMPARISONS = {"$eq": np.equal, "$ne": np.not_equal, "$gt": np.greater, "$lt": np.less, "$le": np.less_equal,
+                       "$ge": np.greater_equal}
+
+
+class CategoricalColumn(object):
+    """Dictionary encoded column of a single valued track property."""
+
+    def __init__(self, values):
+        """Create column from the property value of each track."""
+        codes_dict = {}
+        self.__codes = np.fromiter((codes_dict.setdefault(v, len(codes_dict)) for v in values),
+                                   dtype=np.int32, count=len(values))
+        self.__dictionary = list(codes_dict)
+        self.__value_codes = codes_dict
+        self.__counts = None
+
+    @property
+    def dictionary(self):
+        """Get distinct values of the column."""
+        return self.__dictionary
+
+    @property
+    def codes(self):
+        """Get position in dictionary of each track value."""
+        return self.__codes
+
+    @property
+    def counts(self):
+        """Get number of times each dictionary value appears in the column."""
+        if self.__counts is None:
+            self.__counts = np.bincount(self.__codes, minlength=len(self.__dictionary))
+        return self.__counts
+
+    def count(self, values):
+        """Get number of column values equal to any of some values, looking them up instead of scanning the column."""
+        codes = set()
+        for value in values:
+            try:
+                code = self.__value_codes.get(value)
+            except TypeError:
+                continue
+            if code is not None:
+                codes.add(code)
+        return int(self.counts[list(codes)].sum())
+
+    def dictionary_mask(self, predicate):
+        """Get boolean mask of the dictionary values that match the predicate."""
+        return np.fromiter((predicate(v) for v in self.__dictionary), dtype=bool, count=len(self.__dictionary))
+
+    def mask(self, predicate):
+        """Get boolean mask of the tracks whose value matches the predicate.
+
+        The predicate is evaluated only once per distinct value of the column.
+        """
+        return self.dictionary_mask(predicate)[self.__codes]
+
+    def filter_mask(self, track_filter):
+        """Get boolean mask of the tracks that match a property filter."""
+        return self.mask(track_filter.match_value)
+
+
+class NumericColumn(CategoricalColumn):
+    """Column of a single valued numeric track property."""
+
+    def __init__(self, values):
+        """Create column from the property value of each track."""
+        self.__values = np.asarray(values)
+        self.__sorted_values = None
+        super().__init__(values)
+
+    @property
+    def values(self):
+        """Get array of the track values."""
+        return self.__values
+
+    def filter_mask(self, track_filter):
+        """Get boolean mask of the tracks that match a property filter.
+
+        Comparisons with a number are evaluated on the array of values at once when all the values are numbers.
+        """
+        comparison = NUMERIC_COMPARISONS.get(track_filter.operator)
+        if (comparison is not None and self.__values.dtype.kind in "iuf" and
+                isinstance(track_filter.value, numbers.Real)):
+            return comparison(self.__values, track_filter.value)
+        return super().filter_mask(track_filter)
+
+    def count_range(self, operator, value):
+        """Get number of column values that compare with an operator to a number, or None if they are not numbers."""
+        if self.__values.dtype.kind not in "iuf" or not isinstance(value, numbers.Real):
+            return None
+        if self.__sorted_values is None:
+            self.__sorted_values = np.sort(self.__values)
+        side = 'right' if operator in ["$gt", "$le"] else 'left'
+        position = int(np.searchsorted(self.__sorted_values, value, side=side))
+        return len(self.__sorted_values) - position if operator in ["$gt", "$ge"] else position
+
+
+class MultiValuedColumn(CategoricalColumn):
+    """Dictionary encoded column of a track property that holds a list of values."""
+
+    def __init__(self, values):
+        """Create column from the list of property values of each track."""
+        lengths = np.fromiter((len(v) for v in values), dtype=np.int64, count=len(values))
+        self.__offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.__offsets[1:])
+        self.__lengths = lengths
+        super().__init__([v for track_values in values for v in track_values])
+
+    @property
+    def owners(self):
+        """Get position of the track each value of codes belongs to."""
+        return np.repeat(np.arange(len(self.__lengths)), self.__lengths)
+
+    @property
+    def mean_length(self):
+        """Get mean number of values per track."""
+        return float(self.__lengths.mean()) if len(self.__lengths) else 0.0
+
+    @property
+    def offsets(self):
+        """Get position in codes where the values of each track start, plus the total number of values."""
+        return self.__offsets
+
+    def mask(self, predicate, list_method=any):
+        """Get boolean mask of the tracks whose values match the predicate according to the list method."""
+        values_mask = super().mask(predicate)
+        matches = np.zeros(len(values_mask) + 1, dtype=np.int64)
+        np.cumsum(values_mask, out=matches[1:])
+        track_matches = matches[self.__offsets[1:]] - matches[self.__offsets[:-1]]
+        if list_method is all:
+            return track_matches == self.__lengths
+        return track_matches > 0
+
+    def filter_mask(self, track_filter):
+        """Get boolean mask of the tracks that match a property filter."""
+        return self.mask(track_filter.match_value, track_filter.list_method)
+
+
+class TrackLibrary(object):
+    """Columnar representation of a list of tracks to evaluate track filters on all of them at once."""
+
+    def __init__(self, tracks):
+        """Create track library from a list of tracks."""
+        self.__tracks = list(tracks)
+        self.__columns = {}
+
+    @property
+    def tracks(self):
+        """Get library tracks."""
+        return self.__tracks
+
+    def __len__(self):
+        """Get number of tracks in the library."""
+        return len(self.__tracks)
+
+    def column(self, track_property):
+        """Get column of a track property, that is built the first time it is requested."""
+        if track_property not in self.__columns:
+            values = [getattr(t, track_property) for t in self.__tracks]
+            if track_property in MULTI_VALUED_PROPERTIES:
+                column = MultiValuedColumn(values)
+            elif track_property in NUMERIC_PROPERTIES:
+                column = NumericColumn(values)
+            else:
+                column = CategoricalColumn(values)
+            self.__columns[track_property] = column
+        return self.__columns[track_property]
+
+    def mask(self, track_filter):
+        """Get boolean mask of the library tracks that match a track filter."""
+        return track_filter.mask(self)
+
+    def filter(self, track_filter):
+        """Get library tracks that match a track filter."""
+        return [self.__tracks[i] for i in np.flatnonzero(self.mask(track_filter))]
+
+
+def filter_key(track_filter):
+    """Get key that is the same for equivalent track filters, regardless of the order of aggregated filters."""
+    if isinstance(track_filter, TrackNotFilter):
+        return f"$not({filter_key(track_filter.track_filter)})"
+    if isinstance(track_filter, TrackAggregateFilter):
+        return f"{track_filter.operator}({','.join(sorted(filter_key(f) for f in track_filter.track_filters))})"
+    if track_filter.operator in ["$in", "$ni"]:
+        values = sorted(json.dumps(v, sort_keys=True) for v in track_filter.value)
+        return f"{track_filter.operator}({json.dumps(track_filter.track_property)},[{','.join(values)}])"
+    return json.dumps(track_filter.__dict__, sort_keys=True)
+
+
+class TrackIndex(object):
+    """Inverted indexes of a track library to get the tracks that match a filter.
+
+    Each property has an index from its values to the sorted positions of the tracks that have them, and numeric
+    properties also a sorted index to get value ranges. Property filters set the bits of a bitmap with the positions
+    obtained from the indexes and the rest of filters are evaluated as bitmap operations, scanning the library only
+    for the filters that can not use an index, like regex matches.
+    """
+
+    def __init__(self, library):
+        """Create track index of a library, whose indexes are built the first time they are requested."""
+        self.__library = library
+        self.__postings = {}
+        self.__sorted_positions = {}
+
+    @property
+    def library(self):
+        """Get indexed track library."""
+        return self.__library
+
+    def postings(self, track_property):
+        """Get dict from each value of a property to the sorted positions of the tracks that have it."""
+        if track_property not in self.__postings:
+            column = self.__library.column(track_property)
+            order = np.argsort(column.codes, kind='stable')
+            positions = order if not isinstance(column, MultiValuedColumn) else column.owners[order]
+            value_positions = np.split(positions, np.cumsum(column.counts)[:-1]) if len(column.dictionary) else []
+            if isinstance(column, MultiValuedColumn):
+                value_positions = [np.unique(p) for p in value_positions]
+            self.__postings[track_property] = dict(zip(column.dictionary, value_positions))
+        return self.__postings[track_property]
+
+    def __sorted_index(self, track_property):
+        """Get positions of the tracks sorted by a numeric property and its sorted values."""
+        if track_property not in self.__sorted_positions:
+            values = self.__library.column(track_property).values
+            order = np.argsort(values, kind='stable')
+            self.__sorted_positions[track_property] = (order, values[order])
+        return self.__sorted_positions[track_property]
+
+    def __values_mask(self, track_property, values):
+        postings = self.postings(track_property)
+        mask = np.zeros(len(self.__library), dtype=bool)
+        for value in values:
+            if value in postings:
+                mask[postings[value]] = True
+        return mask
+
+    def __range_mask(self, track_filter):
+        order, sorted_values = self.__sorted_index(track_filter.track_property)
+        value = track_filter.value
+        if track_filter.operator == "$gt":
+            positions = order[np.searchsorted(sorted_values, value, side='right'):]
+        elif track_filter.operator == "$ge":
+            positions = order[np.searchsorted(sorted_values, value, side='left'):]
+        elif track_filter.operator == "$lt":
+            positions = order[:np.searchsorted(sorted_values, value, side='left')]
+        else:
+            positions = order[:np.searchsorted(sorted_values, value, side='right')]
+        mask = np.zeros(len(self.__library), dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def mask(self, track_filter, memo=None):
+        """Get boolean mask of the library tracks that match a track filter.
+
+        If a memo dict is provided, the masks of the filter and its subfilters are kept in it by their filter key, so
+        equivalent subfilters shared by the filters evaluated with the same memo are only evaluated once. Masks in the
+        memo must not be modified.
+        """
+        if memo is None:
+            return self.__mask(track_filter, None)
+        key = filter_key(track_filter)
+        if key not in memo:
+            memo[key] = self.__mask(track_filter, memo)
+        return memo[key]
+
+    def __mask(self, track_filter, memo):
+        if isinstance(track_filter, TrackNotFilter):
+            return ~self.mask(track_filter.track_filter, memo)
+        if isinstance(track_filter, TrackAggregateFilter):
+            result = np.full(len(self.__library), track_filter.operator == "$and")
+            for f in track_filter.track_filters:
+                if track_filter.operator == "$and":
+                    result &= self.mask(f, memo)
+                    if not result.any():
+                        break
+                else:
+                    result |= self.mask(f, memo)
+                    if result.all():
+                        break
+            return result
+        if isinstance(track_filter, TrackPropertyFilter):
+            operator = track_filter.operator
+            if operator in ["$eq", "$ne"]:
+                mask = self.__values_mask(track_filter.track_property, [track_filter.value])
+                return mask if operator == "$eq" else ~mask
+            if operator in ["$in", "$ni"]:
+                mask = self.__values_mask(track_filter.track_property, track_filter.value)
+                return mask if operator == "$in" else ~mask
+            if (operator in ["$gt", "$lt", "$le", "$ge"] and track_filter.track_property in NUMERIC_PROPERTIES and
+                    isinstance(track_filter.value, numbers.Real)):
+                return self.__range_mask(track_filter)
+        return track_filter.mask(self.__library)
+
+    def filter(self, track_filter):
+        """Get library tracks that match a track filter."""
+        tracks = self.__library.tracks
+        return [tracks[i] for i in np.flatnonzero(self.mask(track_filter))]
+
+    def filter_many(self, track_filters):
+        """Get library tracks that match each track filter, evaluating only once the subfilters they share."""
+        tracks = self.__library.tracks
+        memo = {}
+        return [[tracks[i] for i in np.flatnonzero(self.mask(f, memo))] for f in track_filters]
+
+
+def encode_cursor(key):
+    """Get opaque page cursor that points to the track with a key."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Get key of the track a page cursor points to, that is a string or a tuple of strings."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+    if isinstance(key, str):
+        return key
+    if isinstance(key, list) and key and all(isinstance(k, str) for k in key):
+        return tuple(key)
+    raise InvalidCursorException(f"Invalid cursor {cursor}")
+
+
+class LibrarySnapshot(object):
+    """Tracks of a user library at a given moment.
+
+    Each track has a key that identifies it in the library, like the date it was saved plus its uri, that allows to
+    know which tracks of the library were already obtained when the library is refreshed.
+
+    A snapshot obtained refreshing a previous one knows the version of that base snapshot and the keys of the tracks
+    added and removed since it, so what was computed from the base snapshot can be updated with just those changes.
+    The changes since the last few versions before the base one are also kept, combined, in its deltas.
+    """
+
+    def __init__(self, keys, tracks, etag=None, fetched_at=None, library=None, index=None, base_version=None,
+                 added_keys=(), removed_keys=(), deltas=None):
+        """Create library snapshot with the keys and tracks sorted as in the library.
+
+        Deltas are a dict from previous versions, newest first, to the keys of the tracks added and removed since each
+        of them. By default they are only the changes since the base version.
+        """
+        self.__keys = list(keys)
+        self.__tracks = list(tracks)
+        self.__etag = etag
+        self.__fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.__library = library
+        self.__index = index
+        self.__base_version = base_version
+        self.__added_keys = tuple(added_keys)
+        self.__removed_keys = tuple(removed_keys)
+        if deltas is None:
+            deltas = {}
+            if base_version is not None:
+                deltas[base_version] = (frozenset(added_keys), frozenset(removed_keys))
+        self.__deltas = deltas
+        self.__positions = None
+        self.__version = None
+
+    @property
+    def keys(self):
+        """Get snapshot track keys."""
+        return self.__keys
+
+    @property
+    def tracks(self):
+        """Get snapshot tracks."""
+        return self.__tracks
+
+    @property
+    def etag(self):
+        """Get ETag of the library when the snapshot was fetched."""
+        return self.__etag
+
+    @property
+    def fetched_at(self):
+        """Get timestamp when the snapshot was fetched."""
+        return self.__fetched_at
+
+    @property
+    def base_version(self):
+        """Get version of the snapshot this one was refreshed from or None if it was fetched from scratch."""
+        return self.__base_version
+
+    @property
+    def added_keys(self):
+        """Get keys of the tracks added since the base snapshot."""
+        return self.__added_keys
+
+    @property
+    def removed_keys(self):
+        """Get keys of the tracks removed since the base snapshot."""
+        return self.__removed_keys
+
+    @property
+    def deltas(self):
+        """Get dict from previous versions to the keys of the tracks added and removed since each of them."""
+        return self.__deltas
+
+    @property
+    def version(self):
+        """Get version that changes when tracks are added or removed from the library."""
+        if self.__version is None:
+            digest = hashlib.sha1()
+            for key in self.__keys:
+                digest.update(repr(key).encode())
+            self.__version = digest.hexdigest()
+        return self.__version
+
+    @property
+    def library(self):
+        """Get columnar track library of the snapshot tracks."""
+        if self.__library is None:
+            self.__library = TrackLibrary(self.__tracks)
+        return self.__library
+
+    @property
+    def index(self):
+        """Get inverted indexes of the snapshot tracks."""
+        if self.__index is None:
+            self.__index = TrackIndex(self.library)
+        return self.__index
+
+    def __len__(self):
+        """Get number of tracks in the snapshot."""
+        return len(self.__tracks)
+
+    def position(self, key):
+        """Get position of a track key in the snapshot or None if it is not in the snapshot."""
+        if self.__positions is None:
+            self.__positions = {k: i for i, k in enumerate(self.__keys)}
+        return self.__positions.get(key)
+
+    def refreshed(self, etag=None, fetched_at=None):
+        """Get same snapshot as fetched again with no changes."""
+        return LibrarySnapshot(self.__keys, self.__tracks, etag if etag is not None else self.__etag, fetched_at,
+                               self.__library, self.__index, self.__base_version, self.__added_keys,
+                               self.__removed_keys, self.__deltas)
+
+    def changed(self, keys, tracks, etag=None, added_keys=(), removed_keys=()):
+        """Get snapshot of the library after some tracks were added and removed from the ones of this snapshot.
+
+        The changes are combined with the deltas of this snapshot, so the new one knows the changes since this
+        version and the previous ones this snapshot knows, up to a maximum number of versions.
+        """
+        added_keys = tuple(added_keys)
+        removed_keys = tuple(removed_keys)
+        added_set, removed_set = frozenset(added_keys), frozenset(removed_keys)
+        deltas = {self.version: (added_set, removed_set)}
+        for version, (previous_added_keys, previous_removed_keys) in self.__deltas.items():
+            if len(deltas) == MAX_SNAPSHOT_DELTAS:
+                break
+            # Keys are unique in the library history, so tracks added and removed later were never in that version
+            deltas.setdefault(version, ((previous_added_keys - removed_set) | added_set,
+                                        previous_removed_keys | (removed_set - previous_added_keys)))
+        return LibrarySnapshot(keys, tracks, etag, base_version=self.version, added_keys=added_keys,
+                               removed_keys=removed_keys, deltas=deltas)
+
+    def changes_since(self, version):
+        """Get keys of the tracks added and removed since a previous version or None if they are not known."""
+        if version == self.version:
+            return frozenset(), frozenset()
+        return self.__deltas.get(version)
+
+    def page(self, limit, cursor=None, positions=None):
+        """Get positions of a page of tracks and the cursor of the next page, or None if it is the last one.
+
+        Pages are taken from the sorted positions provided or from all the snapshot tracks. Cursors point to the last
+        track of their previous page, so pages stay the same when tracks are added before them in newer snapshots.
+        If that track has been removed, the page goes on from the first track saved before it, as long as no other
+        track was saved at the same time, because those are not sorted in any known order.
+        """
+        positions = np.arange(len(self.__keys)) if positions is None else np.asarray(positions)
+        start = 0
+        if cursor is not None:
+            start = int(np.searchsorted(positions, self.__next_position(decode_cursor(cursor))))
+        page_positions = positions[start:start + limit]
+        next_cursor = None
+        if start + limit < len(positions) and len(page_positions):
+            next_cursor = encode_cursor(self.__keys[page_positions[-1]])
+        return page_positions, next_cursor
+
+    def __next_position(self, key):
+        """Get position of the track after a track key, or of the first one saved before it if it is removed."""
+        position = self.position(key)
+        if position is not None:
+            return position + 1
+        first_key = self.__keys[0] if self.__keys else key
+        if not isinstance(key, tuple) or not isinstance(first_key, tuple) or len(key) != len(first_key):
+            raise InvalidCursorException(f"Cursor track {key} is not a track of the library")
+        # Keys start with the date tracks were saved and the library is sorted newest first
+        added_at = key[0]
+        if any(k[0] == added_at for k in self.__keys):
+            raise InvalidCursorException(f"Cursor track {key} has been removed from the library")
+        return next((i for i, k in enumerate(self.__keys) if k[0] < added_at), len(self.__keys))
+
+    def track(self, key):
+        """Get track of a key or None if it is not in the snapshot."""
+        position = self.position(key)
+        return self.__tracks[position] if position is not None else None
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Track filter planner objects package."""
+from .library import MULTI_VALUED_PROPERTIES, NUMERIC_PROPERTIES
+from .track import TrackPropertyFilter, TrackAggregateFilter, TrackNotFilter
+
+
+# Operators whose negation is other operator for both single and list properties
+NEGATED_OPERATORS = {"$eq": "$ne", "$ne": "$eq", "$in": "$ni", "$ni": "$in", "$match": "$nmatch", "$nmatch": "$match"}
+# Operators whose negation is other operator only for single value properties
+SINGLE_VALUE_NEGATED_OPERATORS = {"$gt": "$le", "$le": "$gt", "$lt": "$ge", "$ge": "$lt"}
+# Operators that can be merged in a list one for each aggregation operator
+MERGEABLE_OPERATORS = {"$or": ("$eq", "$in"), "$and": ("$ne", "$ni")}
+
+OPERATOR_COSTS = {"$match": 10, "$nmatch": 10}
+DEFAULT_SELECTIVITIES = {"$eq": 0.1, "$ne": 0.9, "$gt": 0.5, "$lt": 0.5, "$le": 0.5, "$ge": 0.5,
+                         "$match": 0.25, "$nmatch": 0.75}
+DEFAULT_LIST_LENGTH = 3
+
+
+class TrackFilterPlanner(object):
+    """Rewrite track filters into equivalent ones that are faster to evaluate.
+
+    Negations are pushed down to the property filters, nested aggregations are flattened, equality filters on the
+    same property are merged into membership ones, and the filters of each aggregation are sorted so the cheaper ones
+    or the ones more likely to decide the result are evaluated first. If a track library is provided, its columns are
+    used to estimate the tracks that each property filter matches.
+    """
+
+    def __init__(self, library=None):
+        """Create track filter planner."""
+        self.__library = library
+
+    def plan(self, track_filter):
+        """Get track filter equivalent to the provided one that is faster to evaluate."""
+        return self.__rewrite(track_filter)
+
+    def __rewrite(self, track_filter, negated=False):
+        if isinstance(track_filter, TrackNotFilter):
+            return self.__rewrite(track_filter.track_filter, not negated)
+        if isinstance(track_filter, TrackAggregateFilter):
+            operator = track_filter.operator
+            if negated:
+                operator = "$or" if operator == "$and" else "$and"
+            track_filters = []
+            for f in track_filter.track_filters:
+                f = self.__rewrite(f, negated)
+                if isinstance(f, TrackAggregateFilter) and f.operator == operator:
+                    track_filters.extend(f.track_filters)
+                else:
+                    track_filters.append(f)
+            track_filters = self.__merge(operator, track_filters)
+            if len(track_filters) == 1:
+                return track_filters[0]
+            return TrackAggregateFilter(operator, self.__sort(operator, track_filters))
+        if negated:
+            return self.__negate(track_filter)
+        return track_filter
+
+    @staticmethod
+    def __negate(track_filter):
+        operator = track_filter.operator
+        if operator in NEGATED_OPERATORS:
+            return TrackPropertyFilter(NEGATED_OPERATORS[operator], track_filter.track_property, track_filter.value)
+        if operator in SINGLE_VALUE_NEGATED_OPERATORS and track_filter.track_property not in MULTI_VALUED_PROPERTIES:
+            return TrackPropertyFilter(SINGLE_VALUE_NEGATED_OPERATORS[operator], track_filter.track_property,
+                                       track_filter.value)
+        return TrackNotFilter(track_filter)
+
+    @staticmethod
+    def __merge(operator, track_filters):
+        """Merge the value and list filters of the same property that can be expressed as a single list filter."""
+        value_operator, list_operator = MERGEABLE_OPERATORS[operator]
+        merged_filters = []
+        property_filters = {}
+        for track_filter in track_filters:
+            if (not isinstance(track_filter, TrackPropertyFilter) or
+                    track_filter.operator not in [value_operator, list_operator]):
+                merged_filters.append(track_filter)
+                continue
+            if track_filter.track_property not in property_filters:
+                property_filters[track_filter.track_property] = []
+                merged_filters.append(track_filter.track_property)
+            property_filters[track_filter.track_property].append(track_filter)
+
+        for i, track_property in enumerate(merged_filters):
+            if isinstance(track_property, str):
+                same_property_filters = property_filters[track_property]
+                if len(same_property_filters) == 1:
+                    merged_filters[i] = same_property_filters[0]
+                    continue
+                values = []
+                for f in same_property_filters:
+                    for value in ([f.value] if f.operator == value_operator else f.value):
+                        if value not in values:
+                            values.append(value)
+                merged_filters[i] = TrackPropertyFilter(list_operator, track_property, values)
+        return merged_filters
+
+    def __sort(self, operator, track_filters):
+        """Sort filters by the cost of evaluating them per probability that they decide the aggregation result."""
+        def rank(track_filter):
+            selectivity = self.__selectivity(track_filter)
+            decisive_probability = 1 - selectivity if operator == "$and" else selectivity
+            return self.__cost(track_filter) / max(decisive_probability, 1e-6)
+
+        return sorted(track_filters, key=rank)
+
+    def __list_length(self, track_property):
+        if self.__library is not None:
+            return self.__library.column(track_property).mean_length
+        return DEFAULT_LIST_LENGTH
+
+    def __cost(self, track_filter):
+        """Get estimated cost of evaluating a filter against a track."""
+        if isinstance(track_filter, TrackNotFilter):
+            return self.__cost(track_filter.track_filter)
+        if isinstance(track_filter, TrackAggregateFilter):
+            return sum(self.__cost(f) for f in track_filter.track_filters)
+        cost = OPERATOR_COSTS.get(track_filter.operator, 1)
+        if track_filter.track_property in MULTI_VALUED_PROPERTIES:
+            cost *= max(self.__list_length(track_filter.track_property), 1)
+        return cost
+
+    def __selectivity(self, track_filter):
+        """Get estimated probability that a track matches a filter."""
+        if isinstance(track_filter, TrackNotFilter):
+            return 1 - self.__selectivity(track_filter.track_filter)
+        if isinstance(track_filter, TrackAggregateFilter):
+            probability = 1
+            for f in track_filter.track_filters:
+                if track_filter.operator == "$and":
+                    probability *= self.__selectivity(f)
+                else:
+                    probability *= 1 - self.__selectivity(f)
+            return probability if track_filter.operator == "$and" else 1 - probability
+        selectivity = self.__library_selectivity(track_filter)
+        if selectivity is not None:
+            return selectivity
+        if track_filter.operator in ["$in", "$ni"]:
+            in_selectivity = min(DEFAULT_SELECTIVITIES["$eq"] * len(track_filter.value), 0.9)
+            return in_selectivity if track_filter.operator == "$in" else 1 - in_selectivity
+        return DEFAULT_SELECTIVITIES[track_filter.operator]
+
+    def __library_selectivity(self, track_filter):
+        """Get probability that a track matches a property filter from library statistics if possible.
+
+        Only the counts of the values compared for equality or in a numeric range are used, as they are obtained
+        without evaluating the filter against the library.
+        """
+        if self.__library is None or not len(self.__library):
+            return None
+        column = self.__library.column(track_filter.track_property)
+        total = len(column.codes)
+        if not total:
+            return None
+        operator = track_filter.operator
+        if operator in ["$eq", "$ne"]:
+            matches = column.count([track_filter.value])
+        elif operator in ["$in", "$ni"] and isinstance(track_filter.value, (list, tuple)):
+            matches = column.count(track_filter.value)
+        elif operator in SINGLE_VALUE_NEGATED_OPERATORS and track_filter.track_property in NUMERIC_PROPERTIES:
+            matches = column.count_range(operator, track_filter.value)
+            if matches is None:
+                return None
+        else:
+            return None
+        if operator in ["$ne", "$ni"]:
+            matches = total - matches
+        value_selectivity = matches / total
+        if track_filter.track_property not in MULTI_VALUED_PROPERTIES:
+            return float(value_selectivity)
+        if track_filter.list_method is all:
+            return float(value_selectivity ** column.mean_length)
+        return float(1 - (1 - value_selectivity) ** column.mean_length)
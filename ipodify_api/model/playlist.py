@@ -71,3 +71,53 @@ class Playlist(Identifiable):
     def __repr__(self):
         """Get string representation of the playlist."""
         return str(self.__dict__)
+
+
+class PlaylistContents(Identifiable):
+    """Materialized tracks of a playlist for a version of its owner library."""
+
+    def __init__(self, playlist_id, filter_key, library_version, track_keys):
+        """Create playlist contents entity from the keys of the library tracks that match the playlist filter."""
+        self.__playlist_id = playlist_id
+        self.__filter_key = filter_key
+        self.__library_version = library_version
+        self.__track_keys = frozenset(track_keys)
+
+    @property
+    def playlist_id(self):
+        """Get id of the materialized playlist."""
+        return self.__playlist_id
+
+    @property
+    def filter_key(self):
+        """Get key of the playlist track filter the contents were materialized with."""
+        return self.__filter_key
+
+    @property
+    def library_version(self):
+        """Get version of the library the contents were materialized from."""
+        return self.__library_version
+
+    @property
+    def track_keys(self):
+        """Get keys of the library tracks that match the playlist filter."""
+        return self.__track_keys
+
+    @property
+    def id(self):
+        """Get playlist contents id."""
+        return self.__playlist_id
+
+    @property
+    def __dict__(self):
+        """Get dict representation of the playlist contents."""
+        return {
+            'playlist_id': self.__playlist_id,
+            'filter_key': self.__filter_key,
+            'library_version': self.__library_version,
+            'track_keys': sorted(self.__track_keys, key=repr)
+        }
+
+    def __repr__(self):
+        """Get string representation of the playlist contents."""
+        return str(self.__dict__)
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 """Track model objects package."""
 from abc import ABCMeta, abstractmethod
+from functools import lru_cache
+from operator import attrgetter
 
+import numpy as np
 import operator as ops
 import re
+import sys
 
 
 class InvalidOperatorException(Exception):
@@ -24,6 +28,24 @@ class InvalidTrackFilterDictException(Exception):
     pass
 
 
+class InvalidFilterValueException(Exception):
+    """Exception raise when filter object created with an invalid value for its operator."""
+
+    pass
+
+
+REGEX_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _compile_regex(regex):
+    """Get compiled regex, shared by all the filters in the process that use the same one."""
+    try:
+        return re.compile(regex)
+    except (re.error, TypeError) as e:
+        raise InvalidFilterValueException(f"{regex} is not a valid regex: {e}")
+
+
 # TODO: Track filter could be generalized as property filter
 class TrackFilter(metaclass=ABCMeta):
     """Abstract track filter class."""
@@ -38,6 +60,20 @@ class TrackFilter(metaclass=ABCMeta):
         """Return if the track matches against the filter."""
         pass
 
+    @abstractmethod
+    def compile(self):
+        """Return a predicate function that gives the same result as match for a track.
+
+        The whole filter tree is resolved once, so evaluating the returned function does not walk the filter objects
+        nor build intermediate lists, and aggregations stop as soon as their result is known.
+        """
+        pass
+
+    @abstractmethod
+    def mask(self, library):
+        """Return boolean array with the tracks of a columnar track library that match against the filter."""
+        pass
+
     @staticmethod
     def _decompose_filter(filter_dict):
         if len(filter_dict) != 1:
@@ -93,12 +129,12 @@ class TrackPropertyFilter(TrackFilter):
             else:
                 self.__list_method = any
         elif operator == "$match":
-            # TODO: Raise exception if value is not a valid regex
-            self.__method = lambda sp, regex: bool(re.match(regex, sp))
+            pattern = _compile_regex(value)
+            self.__method = lambda sp, regex: bool(pattern.match(sp))
             self.__list_method = any
         elif operator == "$nmatch":
-            # TODO: Raise exception if value is not a valid regex
-            self.__method = lambda sp, regex: not bool(re.match(regex, sp))
+            pattern = _compile_regex(value)
+            self.__method = lambda sp, regex: not bool(pattern.match(sp))
             self.__list_method = all
         elif operator == "$in":
             # TODO: Raise exception if value is not a list
@@ -115,16 +151,76 @@ class TrackPropertyFilter(TrackFilter):
         self.__track_property = track_property
         self.__value = value
 
+    @property
+    def operator(self):
+        """Get filter operator."""
+        return self.__operator
+
+    @property
+    def track_property(self):
+        """Get name of the track property the filter is applied to."""
+        return self.__track_property
+
+    @property
+    def value(self):
+        """Get value the track property is compared with."""
+        return self.__value
+
+    @property
+    def list_method(self):
+        """Get function that aggregates the results of the values of list properties, any or all."""
+        return self.__list_method
+
+    def match_value(self, property_value):
+        """Return if a single value of the track property matches against the filter."""
+        return self.__method(property_value, self.__value)
+
     def match(self, track):
         """Return if the track matches against the filter."""
         # TODO: Make comparisons lowercase and ignoring accents when strings
         # TODO: Raise exception if "gt", "lt", "le", "ge" operations are executed againsts list properties
         property_value = getattr(track, self.__track_property)
-        if not isinstance(property_value, list):
+        if not isinstance(property_value, (list, tuple)):
             return self.__method(property_value, self.__value)
         else:
             return self.__list_method([self.__method(v, self.__value) for v in property_value])
 
+    def compile(self):
+        """Return a predicate function that gives the same result as match for a track."""
+        method = self.__method
+        value = self.__value
+        get_property = attrgetter(self.__track_property)
+        if self.__operator in ["$in", "$ni"]:
+            try:
+                value = frozenset(value)
+            except TypeError:
+                pass
+
+        if self.__list_method is any:
+            def predicate(track):
+                property_value = get_property(track)
+                if not isinstance(property_value, (list, tuple)):
+                    return method(property_value, value)
+                for v in property_value:
+                    if method(v, value):
+                        return True
+                return False
+        else:
+            def predicate(track):
+                property_value = get_property(track)
+                if not isinstance(property_value, (list, tuple)):
+                    return method(property_value, value)
+                for v in property_value:
+                    if not method(v, value):
+                        return False
+                return True
+
+        return predicate
+
+    def mask(self, library):
+        """Return boolean array with the tracks of a columnar track library that match against the filter."""
+        return library.column(self.__track_property).filter_mask(self)
+
     @classmethod
     def _fromComponents(cls, operator, value):
         return cls(operator, *cls._decompose_filter(value))
@@ -156,10 +252,71 @@ class TrackAggregateFilter(TrackFilter):
         self.__operator = operator
         self.__track_filters = track_filters
 
+    @property
+    def operator(self):
+        """Get filter operator."""
+        return self.__operator
+
+    @property
+    def track_filters(self):
+        """Get aggregated track filters."""
+        return self.__track_filters
+
     def match(self, track):
         """Return if the track matches against the filter."""
         return self.__method([f.match(track) for f in self.__track_filters])
 
+    def _flatten(self):
+        """Get child filters merging the ones of nested aggregations with the same operator."""
+        for track_filter in self.__track_filters:
+            if isinstance(track_filter, TrackAggregateFilter) and track_filter.__operator == self.__operator:
+                yield from track_filter._flatten()
+            else:
+                yield track_filter
+
+    def compile(self):
+        """Return a predicate function that gives the same result as match for a track."""
+        predicates = tuple(f.compile() for f in self._flatten())
+        if len(predicates) == 1:
+            return predicates[0]
+
+        if self.__operator == "$and":
+            if len(predicates) == 2:
+                first, second = predicates
+                return lambda track: bool(first(track) and second(track))
+
+            def predicate(track):
+                for p in predicates:
+                    if not p(track):
+                        return False
+                return True
+        else:
+            if len(predicates) == 2:
+                first, second = predicates
+                return lambda track: bool(first(track) or second(track))
+
+            def predicate(track):
+                for p in predicates:
+                    if p(track):
+                        return True
+                return False
+
+        return predicate
+
+    def mask(self, library):
+        """Return boolean array with the tracks of a columnar track library that match against the filter."""
+        result = np.full(len(library), self.__operator == "$and")
+        for track_filter in self._flatten():
+            if self.__operator == "$and":
+                result &= track_filter.mask(library)
+                if not result.any():
+                    break
+            else:
+                result |= track_filter.mask(library)
+                if result.all():
+                    break
+        return result
+
     @classmethod
     def _fromComponents(cls, operator, value):
         return cls(operator, [TrackFilter.fromDict(d) for d in value])
@@ -181,10 +338,24 @@ class TrackNotFilter(TrackFilter):
         """Create track filter negation filter."""
         self.__track_filter = track_filter
 
+    @property
+    def track_filter(self):
+        """Get negated track filter."""
+        return self.__track_filter
+
     def match(self, track):
         """Return if the track matches against the filter."""
         return not self.__track_filter.match(track)
 
+    def compile(self):
+        """Return a predicate function that gives the same result as match for a track."""
+        negated = self.__track_filter.compile()
+        return lambda track: not negated(track)
+
+    def mask(self, library):
+        """Return boolean array with the tracks of a columnar track library that match against the filter."""
+        return ~self.__track_filter.mask(library)
+
     @classmethod
     def _fromComponents(cls, operator, value):
         return cls(TrackFilter.fromDict(value))
@@ -195,22 +366,41 @@ class TrackNotFilter(TrackFilter):
         return {"$not": self.__track_filter.__dict__}
 
 
+SHARED_TUPLES_CACHE_SIZE = 65536
+
+
+def _intern(value):
+    """Get the interned string of a value, so equal strings of all tracks are the same object."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=SHARED_TUPLES_CACHE_SIZE)
+def _shared_tuple(values):
+    """Get an equal tuple shared by all the tracks with the same values."""
+    return values
+
+
 class Track(object):
-    """Track entity class."""
+    """Track entity class.
+
+    Artists and genres are kept as immutable tuples shared between tracks.
+    """
+
+    __slots__ = ('__name', '__isrc', '__album', '__release_year', '__language', '__artists', '__genres')
 
     def __init__(self, name, isrc, album, release_year, language, artists, genres):
         """Create track entity."""
         self.__name = name
         self.__isrc = isrc
-        self.__album = album
+        self.__album = _intern(album)
         self.__release_year = release_year
-        self.__language = language
-        self.__artists = artists
-        if not isinstance(self.__artists, list):
-            self.__artists = [self.__artists]
-        self.__genres = genres
-        if self.__genres is None:
-            self.__genres = []
+        self.__language = _intern(language)
+        if not isinstance(artists, (list, tuple)):
+            artists = [artists]
+        self.__artists = _shared_tuple(tuple(_intern(a) for a in artists))
+        if genres is None:
+            genres = []
+        self.__genres = _shared_tuple(tuple(_intern(g) for g in genres))
 
     def match_filter(self, track_filter):
         """Check if the track matches against a filter."""
@@ -260,14 +450,16 @@ class Track(object):
             "release_year": self.__release_year,
             "album": self.__album,
             "language": self.__language,
-            "artists": self.__artists,
-            "genres": self.__genres
+            "artists": list(self.__artists),
+            "genres": list(self.__genres)
         }
 
 
 class SpotifyTrack(Track):
     """Track entity class with references to internal Spotify id."""
 
+    __slots__ = ('__uri', '__href')
+
     def __init__(self, uri, href, name, isrc, album, release_year, language, artists, genres):
         """Create Spotify track entity."""
         self.__uri = uri
@@ -2,7 +2,9 @@
 """Simple in memory model entities repository."""
 # TODO: Only allow to add Identifiable model
 from collections import defaultdict
+from functools import lru_cache
 from inspect import signature
+from operator import attrgetter
 
 
 # TODO: Move filter branch to Filterable entity class?
@@ -15,30 +17,99 @@ def filter_match(_filter, entity):
     return True
 
 
+@lru_cache(maxsize=None)
+def _constructor_arguments(_class):
+    """Get names of the arguments of an entity class constructor, which are also the names of its properties."""
+    return tuple(signature(_class).parameters)
+
+
+def clone(entity):
+    """Get a copy of an entity created with the values of the properties its constructor receives."""
+    _class = entity.__class__
+    return _class(**{a: getattr(entity, a) for a in _constructor_arguments(_class)})
+
+
+@lru_cache(maxsize=None)
+def _properties_getter(properties):
+    """Get function that returns the tuple of values of some properties of an entity."""
+    if len(properties) == 1:
+        getter = attrgetter(properties[0])
+        return lambda entity: (getter(entity),)
+    return attrgetter(*properties)
+
+
 class MemoryRepository(object):
-    """Repository that stores model entities in memory."""
+    """Repository that stores model entities in memory.
 
-    def __init__(self):
+    Secondary indexes can be declared per entity class as a list of tuples of property names, like
+    {Playlist: [("owner",), ("owner", "name")]}. Filters on the properties of an index are resolved with it instead of
+    checking every entity of the class, so the values of indexed properties must be hasheable.
+
+    By default the repository stores a copy of the added entities. If copy is False entities are stored as they are,
+    which is faster for bulk imports, but then they must not be modified after being added.
+    """
+
+    def __init__(self, indexes=None, copy=True):
         """Create memory repository."""
         self.__repo = defaultdict(dict)
+        self.__copy = copy
+        self.__indexes = defaultdict(dict)
+        for _class, class_indexes in (indexes or {}).items():
+            for properties in class_indexes:
+                self.__indexes[_class][tuple(properties)] = defaultdict(dict)
+
+    def __index_entity(self, entity, _id, previous_entity=None):
+        """Update class indexes with an entity that replaces a previous one with the same id, if any."""
+        for properties, index in self.__indexes[entity.__class__].items():
+            get_value = _properties_getter(properties)
+            value = get_value(entity)
+            if previous_entity is not None:
+                previous_value = get_value(previous_entity)
+                if previous_value != value:
+                    self.__unindex_value(index, previous_value, _id)
+            index[value][_id] = entity
+
+    def __unindex_entity(self, entity):
+        """Remove an entity from its class indexes."""
+        for properties, index in self.__indexes[entity.__class__].items():
+            self.__unindex_value(index, _properties_getter(properties)(entity), entity.id)
+
+    @staticmethod
+    def __unindex_value(index, value, _id):
+        entities = index[value]
+        del entities[_id]
+        if not entities:
+            del index[value]
 
     def add(self, *entities):
         """Add entities to repository."""
+        self.add_many(entities)
+
+    def add_many(self, entities):
+        """Add entities of an iterable to repository."""
+        copy = self.__copy
         for entity in entities:
-            arguments = signature(entity.__init__).parameters.keys()
-            arguments_dict = {a: getattr(entity, a) for a in arguments}
-            cloned_entity = entity.__class__(**arguments_dict)
-            self.__repo[entity.__class__][entity.id] = cloned_entity
+            stored_entity = clone(entity) if copy else entity
+            class_entities = self.__repo[entity.__class__]
+            _id = stored_entity.id
+            previous_entity = class_entities.get(_id)
+            class_entities[_id] = stored_entity
+            if self.__indexes.get(entity.__class__):
+                self.__index_entity(stored_entity, _id, previous_entity)
 
     def remove(self, *entities):
         """Remove entities from repository."""
         for entity in entities:
-            del self.__repo[entity.__class__][entity.id]
+            self.__unindex_entity(self.__repo[entity.__class__].pop(entity.id))
 
     def remove_by_id(self, _class, _id):
         """Remove entity from repository by its class and id."""
         self.remove(self.find_by_id(_class, _id))
 
+    def remove_by_ids(self, _class, ids):
+        """Remove entities from repository by its class and ids."""
+        self.remove(*self.find_by_ids(_class, ids))
+
     def remove_by_filter(self, _class, _filter):
         """Remove entities from repository by its class and a filter expression."""
         for entity in self.find_by_filter(_class, _filter):
@@ -56,7 +127,8 @@ class MemoryRepository(object):
         """Update repository entity.
 
         If the entity model object is updated its changes would not be persisted until it is updated in the repository
-        itself. The repository stores a copy of the entity, not the entity itself.
+        itself. The repository stores a copy of the entity, not the entity itself, unless it was created without
+        copies.
         """
         self.add(*entities)
 
@@ -64,10 +136,25 @@ class MemoryRepository(object):
         """Find entity in repository by its class and id."""
         return self.__repo[_class][_id]
 
+    def find_by_ids(self, _class, ids):
+        """Find entities in repository by its class and ids, skipping the ones that are not in the repository."""
+        class_entities = self.__repo[_class]
+        return [class_entities[i] for i in ids if i in class_entities]
+
+    def __candidates(self, _class, _filter):
+        """Get entities that may match a filter, using the class index with more of the filter properties."""
+        indexed_properties = [p for p in self.__indexes[_class] if set(p) <= set(_filter)]
+        if not indexed_properties:
+            return self.__repo[_class].values(), _filter
+        properties = max(indexed_properties, key=len)
+        entities = self.__indexes[_class][properties].get(tuple(_filter[p] for p in properties), {})
+        return entities.values(), {p: v for p, v in _filter.items() if p not in properties}
+
     def find_by_filter(self, _class, _filter):
         """Find entitities in repository by its class and a filter expression."""
-        return [entity for entity in self.__repo[_class].values()
-                if filter_match(_filter, entity)]
+        entities, remaining_filter = self.__candidates(_class, _filter)
+        return [entity for entity in entities
+                if filter_match(remaining_filter, entity)]
 
     def list(self, _class):
         """List all repository entities of a specific class."""
@@ -2,11 +2,18 @@
 """This is crap for my autoenjoyment but does not seem to be really usefull in almost none real scenario."""
 # TODO: Only allow to add Identifiable model
 
+import json
+
+from collections import defaultdict
+
+from ..cache import SQL_BATCH_SIZE
 # TODO: Automatically import all mapped entities
+from ..model import Identifiable
 from ..model.user import User               # noqa: F401
-from ..model.playlist import Playlist       # noqa: F401
+from ..model.playlist import Playlist, PlaylistVisibility
+from ..model.track import TrackFilter
 
-from sqlalchemy import create_engine, Column, String, ForeignKey
+from sqlalchemy import create_engine, and_, or_, Column, String, ForeignKey
 from sqlalchemy.orm import sessionmaker
 
 from sqlalchemy.ext.declarative import declarative_base
@@ -43,6 +50,16 @@ class EntityMap():
              if not k.startswith('_sa')}
         return self.get_entity()(**dict(d))
 
+    @classmethod
+    def to_values(cls, entity):
+        """Get dict with the column values of an entity."""
+        return entity.__dict__
+
+    @staticmethod
+    def to_filter_values(_filter):
+        """Get filter expression with the column values of its entity values."""
+        return {k: v.id if isinstance(v, Identifiable) else v for k, v in _filter.items()}
+
 
 class UserMap(Base, EntityMap):
     """User entity map class."""
@@ -57,9 +74,23 @@ class PlaylistMap(Base, EntityMap):
 
     __tablename__ = "playlists"
 
-    name = Column(String, primary_key=True)
+    # Key columns are sorted as in the playlist id
     owner = Column(String, ForeignKey('users.name'), primary_key=True)
-    description = Column(String)
+    name = Column(String, primary_key=True)
+    visibility = Column(String)
+    track_filter = Column(String)
+
+    def to_entity(self):
+        """Conver map class to entity class."""
+        return Playlist(self.name, User(self.owner), TrackFilter.fromDict(json.loads(self.track_filter)),
+                        PlaylistVisibility(self.visibility))
+
+    @classmethod
+    def to_values(cls, entity):
+        """Get dict with the column values of an entity."""
+        values = entity.__dict__
+        values['track_filter'] = json.dumps(values['track_filter'])
+        return values
 
 
 class SQLRepository(object):
@@ -95,21 +126,82 @@ class SQLRepository(object):
         columns = self._key_columns(_class)
         return {column: ids[i] for i, column in enumerate(columns)}
 
-    def add(self, entity):
-        """Add entity to repository."""
-        self.session.add(EntityMap.get_map(entity.__class__)(**entity.__dict__))
+    def _ids_condition(self, _class, ids):
+        """Get condition that matches the entities with some ids with a single IN or OR expression."""
+        entity_map = EntityMap.get_map(_class)
+        columns = self._key_columns(_class)
+        if len(columns) == 1:
+            return getattr(entity_map, columns[0]).in_(ids)
+        return or_(*[and_(*[getattr(entity_map, c) == v for c, v in self._id_filter(_class, _id).items()])
+                     for _id in ids])
 
-    def remove(self, entity):
-        """Remove entity from repository."""
-        self.remove_by_id(entity.__class__, entity.id)
+    def _batches(self, _class, ids):
+        """Split ids in batches whose key values do not exceed the batch size."""
+        ids = list(ids)
+        batch_size = max(SQL_BATCH_SIZE // len(self._key_columns(_class)), 1)
+        return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    @staticmethod
+    def _by_class(entities):
+        entities_by_class = defaultdict(list)
+        for entity in entities:
+            entities_by_class[entity.__class__].append(entity)
+        return entities_by_class
+
+    def add(self, *entities):
+        """Add entities to repository."""
+        self.add_many(entities)
+
+    def add_many(self, entities):
+        """Add entities of an iterable to repository with a bulk insert per class."""
+        for _class, class_entities in self._by_class(entities).items():
+            entity_map = EntityMap.get_map(_class)
+            self.session.bulk_insert_mappings(entity_map, [entity_map.to_values(e) for e in class_entities])
+
+    def upsert_many(self, entities):
+        """Add entities of an iterable to repository or update them if they already are in it.
+
+        Entities already in the repository are found with a query per batch of ids, and then they are updated and
+        the rest inserted with bulk statements.
+        """
+        for _class, class_entities in self._by_class(entities).items():
+            entity_map = EntityMap.get_map(_class)
+            existing_ids = self.__existing_ids(_class, [e.id for e in class_entities])
+            self.session.bulk_update_mappings(
+                entity_map, [entity_map.to_values(e) for e in class_entities if e.id in existing_ids])
+            self.session.bulk_insert_mappings(
+                entity_map, [entity_map.to_values(e) for e in class_entities if e.id not in existing_ids])
+        # Bulk updates skip the session, so loaded maps are refreshed the next time they are used
+        self.session.expire_all()
+
+    def __existing_ids(self, _class, ids):
+        """Get set with the ids that are in the repository."""
+        entity_map = EntityMap.get_map(_class)
+        columns = [getattr(entity_map, c) for c in self._key_columns(_class)]
+        existing_ids = set()
+        for batch_ids in self._batches(_class, ids):
+            rows = self.session.query(*columns).filter(self._ids_condition(_class, batch_ids))
+            existing_ids.update(':'.join(row) for row in rows)
+        return existing_ids
+
+    def remove(self, *entities):
+        """Remove entities from repository."""
+        for _class, class_entities in self._by_class(entities).items():
+            self.remove_by_ids(_class, [e.id for e in class_entities])
 
     def remove_by_id(self, _class, _id):
         """Remove entity from repository by its class and id."""
         self._query(_class).filter_by(**self._id_filter(_class, _id)).delete()
 
+    def remove_by_ids(self, _class, ids):
+        """Remove entities from repository by its class and ids with a delete per batch of ids."""
+        for batch_ids in self._batches(_class, ids):
+            self._query(_class).filter(self._ids_condition(_class, batch_ids)).delete(synchronize_session=False)
+
     def remove_by_filter(self, _class, _filter):
         """Remove entities from repository by its class and a filter expression."""
-        self._query(_class).filter_by(**_filter).delete()
+        entity_map = EntityMap.get_map(_class)
+        self._query(_class).filter_by(**entity_map.to_filter_values(_filter)).delete()
 
     def contains(self, entity):
         """Return if the repository contains or not an entity."""
@@ -117,29 +209,41 @@ class SQLRepository(object):
 
     def contains_by_id(self, _class, _id):
         """Return if the repository contains by its class and id."""
-        count = self._query(_class).filter_by(**self._id_filter(_class, _id)).count()
-        return count > 0
+        query = self._query(_class).filter_by(**self._id_filter(_class, _id))
+        return self.session.query(query.exists()).scalar()
 
-    def update(self, entity):
-        """Update entity in repository.
+    def update(self, *entities):
+        """Update entities in repository.
 
         If the entity model object is updated its changes would not be persisted until it is updated in the repository
         itself. The repository stores a map of the entity, not the entity itself.
         """
-        columns = self._key_columns(entity._class)
-        entity_filter = {c: entity.getattr(c) for c in columns}
-        entity_map = self.find_by_filter(**entity_filter).first()
-        entity_map
+        self.upsert_many(entities)
         self.session.commit()
 
     def find_by_id(self, _class, _id):
         """Find entity in repository by its class and id."""
         entity_map = self._query(_class).filter_by(**self._id_filter(_class, _id)).first()
+        if entity_map is None:
+            raise KeyError(_id)
         return entity_map.to_entity()
 
+    def find_by_ids(self, _class, ids):
+        """Find entities in repository by its class and ids with a query per batch of ids.
+
+        Entities are returned in the same order as their ids, skipping the ones that are not in the repository.
+        """
+        entities = {}
+        for batch_ids in self._batches(_class, ids):
+            for entity_map in self._query(_class).filter(self._ids_condition(_class, batch_ids)):
+                entity = entity_map.to_entity()
+                entities[entity.id] = entity
+        return [entities[i] for i in ids if i in entities]
+
     def find_by_filter(self, _class, _filter):
         """Find entitities in repository by its class and a filter expression."""
-        entity_maps = self._query(_class).filter_by(**_filter).all()
+        entity_map = EntityMap.get_map(_class)
+        entity_maps = self._query(_class).filter_by(**entity_map.to_filter_values(_filter)).all()
         return [m.to_entity() for m in entity_maps]
 
     def list(self, _class):
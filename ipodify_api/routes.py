@@ -1,18 +1,92 @@
 # -*- coding: utf-8 -*-
 """Ipodify api routes."""
+import hashlib
 import inject
 
 from functools import partial
-from flask import Blueprint, abort, request, make_response, jsonify
+from flask import Blueprint, Response, abort, request, make_response, stream_with_context
 
-from .gateways.spotify import SpotifyGateway, spotify_auth
+from .gateways.spotify import SpotifyGateway, SpotifyUserCache, spotify_auth
+from .error import abort_with_message
 from .schemas import request_schema
+from .serializers import dumps, jsonify, track_projection
 from .use_cases import GetFilterPreviewUseCase, GetLibraryUseCase, GetPlaylistsUseCase, AddPlaylistUseCase, \
-                       GetPlaylistUseCase, RemovePlaylistUseCase
+                       GetPlaylistUseCase, RemovePlaylistUseCase, GetPlaylistsTracksUseCase
 
 
 api = Blueprint('api', __name__)
-spotify_auth = partial(spotify_auth(inject.instance(SpotifyGateway)))
+spotify_auth = partial(spotify_auth(inject.instance(SpotifyGateway), inject.instance(SpotifyUserCache)))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+DEFAULT_PAGE_LIMIT = 500
+MAX_PAGE_LIMIT = 5000
+# Responses depend on the user, so they are only cached by clients, which must revalidate them on every use
+CACHE_CONTROL = 'private, no-cache'
+
+
+def _stream_requested():
+    """Return if the response is requested to be streamed as newline delimited JSON."""
+    return (request.args.get('stream', '').lower() == 'true' or
+            request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE)
+
+
+def _ndjson_response(items):
+    """Get response that streams each item as a JSON line as soon as it is obtained.
+
+    Items should be obtained from an iterator that has already done the requests that may fail, as once the response
+    is returned its status can not be changed anymore.
+    """
+    return Response(stream_with_context(dumps(i) + b"\n" for i in items), mimetype=NDJSON_MIMETYPE)
+
+
+def _page_requested():
+    """Return if a page of the tracks is requested, instead of all of them."""
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def _page_limit():
+    """Get requested number of tracks per page."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        abort_with_message(f"Limit must be an integer between 1 and {MAX_PAGE_LIMIT}", 400)
+    return limit
+
+
+def _track_encoder():
+    """Get function that encodes each track with the requested fields, all of them if none are requested."""
+    if 'fields' not in request.args:
+        return lambda track: track
+    try:
+        return track_projection([f.strip() for f in request.args['fields'].split(',') if f.strip()])
+    except ValueError as e:
+        abort_with_message(str(e), 400)
+
+
+def _tracks_body(encode, tracks, next_cursor=None, **body):
+    """Get body of a response with tracks and, if they are a page, the cursor of the next one."""
+    body["tracks"] = [encode(t) for t in tracks]
+    if _page_requested():
+        body["next_cursor"] = next_cursor
+    return body
+
+
+def _conditional_response(version, get_response):
+    """Get response with an ETag of its version, or 304 Not Modified if the client already has that version.
+
+    The response is only obtained with the get response function if the client does not have it, so nothing is
+    evaluated or serialized for clients that are up to date.
+    """
+    etag = hashlib.sha1(f"{request.full_path}:{version}".encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = get_response()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
 
 
 @api.route('/me', methods=['GET'])
@@ -27,8 +101,15 @@ def get_me(spotify_user):
 @inject.params(get_library_use_case=GetLibraryUseCase)
 def get_library(spotify_user, get_library_use_case):
     """Get library endpoint."""
-    tracks = get_library_use_case.execute(spotify_user)
-    return jsonify({"tracks": tracks})
+    encode = _track_encoder()
+    if _stream_requested():
+        return _ndjson_response(encode(t) for t in get_library_use_case.stream(spotify_user))
+    snapshot = get_library_use_case.get_snapshot(spotify_user)
+    if _page_requested():
+        limit = _page_limit()
+        return _conditional_response(snapshot.version, lambda: jsonify(_tracks_body(
+            encode, *get_library_use_case.get_page(spotify_user, limit, request.args.get('cursor'), snapshot))))
+    return _conditional_response(snapshot.version, lambda: jsonify(_tracks_body(encode, snapshot.tracks)))
 
 
 @api.route('/filter_preview', methods=['GET'])
@@ -38,11 +119,20 @@ def get_library(spotify_user, get_library_use_case):
 def get_filter_preview(spotify_user, get_filter_preview_use_case):
     """Get filter preview endpoint."""
     track_filter_dict = request.json
-    tracks = GetFilterPreviewUseCase.execute(spotify_user, track_filter_dict)
-    return jsonify({
-        "track_filter": track_filter_dict,
-        "tracks": tracks
-    })
+    encode = _track_encoder()
+    if _stream_requested():
+        return _ndjson_response(encode(t) for t in get_filter_preview_use_case.stream(spotify_user, track_filter_dict))
+    snapshot = get_filter_preview_use_case.get_snapshot(spotify_user)
+    version = get_filter_preview_use_case.get_version(spotify_user, track_filter_dict, snapshot)
+    if _page_requested():
+        limit = _page_limit()
+        return _conditional_response(version, lambda: jsonify(_tracks_body(
+            encode, *get_filter_preview_use_case.get_page(spotify_user, track_filter_dict, limit,
+                                                          request.args.get('cursor'), snapshot),
+            track_filter=track_filter_dict)))
+    return _conditional_response(version, lambda: jsonify(_tracks_body(
+        encode, get_filter_preview_use_case.execute(spotify_user, track_filter_dict, snapshot),
+        track_filter=track_filter_dict)))
 
 
 @api.route('/playlists', methods=['GET'])
@@ -51,9 +141,26 @@ def get_filter_preview(spotify_user, get_filter_preview_use_case):
 def get_playlists(spotify_user, get_playlists_use_case):
     """Get playlists endpoint."""
     playlists = get_playlists_use_case.execute(spotify_user.name)
-    return jsonify({
-        'playlists': playlists
-    })
+    return _conditional_response(get_playlists_use_case.get_version(spotify_user.name, playlists),
+                                 lambda: Response(dumps({
+                                     'playlists': playlists
+                                 }), mimetype='application/json'))
+
+
+@api.route('/playlists_tracks', methods=['GET'])
+@spotify_auth
+@inject.params(get_playlists_tracks_use_case=GetPlaylistsTracksUseCase)
+def get_playlists_tracks(spotify_user, get_playlists_tracks_use_case):
+    """Get tracks of all playlists endpoint."""
+    return _conditional_response(
+        get_playlists_tracks_use_case.get_version(spotify_user),
+        lambda: jsonify({
+            'playlists': [{
+                'name': playlist.name,
+                'track_filter': playlist.track_filter,
+                'tracks': tracks
+            } for playlist, tracks in get_playlists_tracks_use_case.execute(spotify_user)]
+        }))
 
 
 @api.route('/playlists', methods=['POST'])
@@ -2,31 +2,65 @@
 """Manage payload schemas."""
 import json
 import os
+import threading
 
 from flask import request
 from functools import wraps
-from jsonschema import validate, ValidationError, RefResolver
+from jsonschema import ValidationError, RefResolver
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 from ..error import abort_with_message
 
 
 SCHEMA_FILES_PATH = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILES_SUFFIX = ".schema.json"
 
 
 def _get_schema_file_name(schema_name):
     """Get schema file name."""
-    return os.path.join(SCHEMA_FILES_PATH, f"{schema_name}.schema.json")
+    return os.path.join(SCHEMA_FILES_PATH, f"{schema_name}{SCHEMA_FILES_SUFFIX}")
 
 
-def validate_schema_data(data, schema_name):
-    """Validate data against an schema."""
-    with open(_get_schema_file_name(schema_name), 'r') as f:
-        schema = json.load(f)
+def _load_schemas():
+    """Load and check all schemas by its name."""
+    schemas = {}
+    for file_name in os.listdir(SCHEMA_FILES_PATH):
+        if file_name.endswith(SCHEMA_FILES_SUFFIX):
+            schema_name = file_name[:-len(SCHEMA_FILES_SUFFIX)]
+            with open(_get_schema_file_name(schema_name), 'r') as f:
+                schema = json.load(f)
+            validator_for(schema).check_schema(schema)
+            schemas[schema_name] = schema
+    return schemas
+
+
+_schemas = _load_schemas()
+# Schemas by its file uri, so references between them are resolved without reading them again
+_schemas_store = {f"file://{_get_schema_file_name(n)}": s for n, s in _schemas.items()}
+# Reference resolvers keep state while validating, so validators are only reused in the same thread
+_validators = threading.local()
+
+
+def _get_validator(schema_name):
+    """Get validator of an schema, that is created once per thread."""
+    validators = _validators.__dict__.setdefault('validators', {})
+    if schema_name not in validators:
+        schema = _schemas[schema_name]
         resolver = RefResolver(
             base_uri=f"file://{SCHEMA_FILES_PATH}/",
-            referrer=schema
+            referrer=schema,
+            store=_schemas_store
         )
-        validate(data, schema, resolver=resolver)
+        validators[schema_name] = validator_for(schema)(schema, resolver=resolver)
+    return validators[schema_name]
+
+
+def validate_schema_data(data, schema_name):
+    """Validate data against an schema."""
+    error = best_match(_get_validator(schema_name).iter_errors(data))
+    if error is not None:
+        raise error
 
 
 # TUNE: This is not useful as some required requests values are obtained via other decorators or parts of the request
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Serialize model objects to JSON."""
+import json
+
+from flask import Response
+from operator import attrgetter
+
+from .model.playlist import Playlist
+from .model.track import Track, SpotifyTrack, TrackFilter
+from .model.user import User
+
+try:
+    import orjson
+except ImportError:     # pragma: no cover
+    orjson = None
+
+
+_encoders = {}
+
+TRACK_FIELDS = ["uri", "href", "name", "isrc", "release_year", "album", "language", "artists", "genres"]
+
+
+def encoder(_class):
+    """Register decorated function as the encoder of a class and its subclasses into JSON compatible objects."""
+    def register(function):
+        _encoders[_class] = function
+        return function
+    return register
+
+
+@encoder(Track)
+def _encode_track(track):
+    return {
+        "name": track.name,
+        "isrc": track.isrc,
+        "release_year": track.release_year,
+        "album": track.album,
+        "language": track.language,
+        "artists": track.artists,
+        "genres": track.genres
+    }
+
+
+@encoder(SpotifyTrack)
+def _encode_spotify_track(track):
+    return {
+        **_encode_track(track),
+        "uri": track.uri,
+        "href": track.href
+    }
+
+
+@encoder(Playlist)
+def _encode_playlist(playlist):
+    return {
+        "name": playlist.name,
+        "owner": playlist.owner.name,
+        "visibility": playlist.visibility.value,
+        "track_filter": playlist.track_filter
+    }
+
+
+@encoder(User)
+def _encode_user(user):
+    return {
+        "name": user.name
+    }
+
+
+@encoder(TrackFilter)
+def _encode_track_filter(track_filter):
+    return track_filter.__dict__
+
+
+def track_projection(fields):
+    """Get function that encodes a track with only some of its fields, to not serialize the rest of them."""
+    invalid_fields = [f for f in fields if f not in TRACK_FIELDS]
+    if not fields or invalid_fields:
+        raise ValueError(f"Invalid track fields {', '.join(invalid_fields)}")
+    fields = list(dict.fromkeys(fields))
+    if len(fields) == 1:
+        field = fields[0]
+        get_value = attrgetter(field)
+        return lambda track: {field: get_value(track)}
+    get_values = attrgetter(*fields)
+    return lambda track: dict(zip(fields, get_values(track)))
+
+
+def to_primitive(obj):
+    """Get JSON compatible representation of an object with the encoder of its class."""
+    _class = obj.__class__
+    if _class not in _encoders:
+        for base_class in _class.__mro__[1:]:
+            if base_class in _encoders:
+                _encoders[_class] = _encoders[base_class]
+                break
+        else:
+            if hasattr(obj, '__dict__'):
+                return obj.__dict__
+            raise TypeError(f"Object of type {_class.__name__} is not JSON serializable")
+    return _encoders[_class](obj)
+
+
+def dumps(obj):
+    """Get UTF-8 encoded JSON of an object, using orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=to_primitive)
+    return json.dumps(obj, default=to_primitive, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def jsonify(obj, status=200):
+    """Get JSON response of an object."""
+    return Response(dumps(obj), status=status, mimetype='application/json')
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 """ipodify api use cases."""
+import hashlib
+import json
+import time
+
 from collections import defaultdict
+from itertools import islice
+
+import numpy as np
 
-from .model.playlist import Playlist
+from .cache import SingleFlight
+from .model.library import LibrarySnapshot, filter_key
+from .model.planner import TrackFilterPlanner
+from .model.playlist import Playlist, PlaylistContents
 from .model.user import User
 from .model.track import TrackFilter, SpotifyTrack
 
@@ -30,14 +40,39 @@ class PersistenceUseCase(object):
 
         return user
 
+    def invalidate_playlist_contents(self, playlist):
+        """Remove materialized contents of a playlist, so they are evaluated again the next time they are requested."""
+        if self.repository.contains_by_id(PlaylistContents, playlist.id):
+            self.repository.remove_by_id(PlaylistContents, playlist.id)
+
 
 class GetLibraryUseCase(object):
     """Get user library use case."""
 
-    def __init__(self, spotify_port):
-        """Create get library use case."""
+    def __init__(self, spotify_port, library_cache=None, library_ttl=60, metadata_cache=None, snapshot_store=None,
+                 fetch_timeout=None):
+        """Create get library use case.
+
+        If a library cache is provided user libraries are kept in it and they are only refreshed from Spotify when
+        they are older than library ttl seconds, requesting only the tracks added since they were fetched.
+
+        If a metadata cache is provided, albums and artists genres are only requested to Spotify when they are not in
+        it.
+
+        If a snapshot store is provided user libraries are also persisted in it, and loaded from it when they are not
+        in the library cache, so they are refreshed instead of fetched again from scratch after a restart.
+
+        Concurrent requests of the same user library version share a single fetch from Spotify, and its result or
+        error, including the requests that stream the library. If a fetch timeout is set, requests that wait for a
+        fetch of other request longer than that raise SingleFlightTimeoutException.
+        """
         super().__init__()
         self.__spotify_port = spotify_port
+        self.__library_cache = library_cache
+        self.__library_ttl = library_ttl
+        self.__metadata_cache = metadata_cache
+        self.__snapshot_store = snapshot_store
+        self.__single_flight = SingleFlight(fetch_timeout)
 
     @staticmethod
     def __language_from_isrc(isrc):
@@ -51,13 +86,29 @@ class GetLibraryUseCase(object):
             return 'French'
         return 'English'
 
-    def execute(self, spotify_user):
-        """Execute use case."""
+    @staticmethod
+    def __item_key(item):
+        return (item.get('added_at'), item.get('track').get('uri'))
+
+    def __genres(self, spotify_user, kind, ids, get_items):
+        """Get genres of albums or artists by id, requesting to Spotify only the ones not in the metadata cache."""
+        genres = {}
+        if self.__metadata_cache is not None:
+            genres = self.__metadata_cache.get_many(kind, ids)
+        fetched_genres = {item.get('id'): item.get('genres') for item in
+                          get_items(spotify_user, [i for i in ids if i not in genres]) if item is not None}
+        if self.__metadata_cache is not None:
+            self.__metadata_cache.set_many(kind, fetched_genres)
+        genres.update(fetched_genres)
+        return genres
+
+    def __enrich(self, spotify_user, spotify_tracks):
+        """Get tracks with album and artists genres from Spotify tracks."""
         tracks = []
         albums_dict = defaultdict(list)
         artists_dict = defaultdict(list)
         # TODO: Do not add local tracks
-        for track in self.__spotify_port.get_library_tracks(spotify_user):
+        for track in spotify_tracks:
             album = track.get('album')
             artists = track.get('artists')
             # TODO: Add date added
@@ -78,17 +129,198 @@ class GetLibraryUseCase(object):
                 artists_dict[artist.get('id')].append(filtered_track)
 
         # TODO: Find a more accurate way to get genres
-        for album in self.__spotify_port.get_albums(spotify_user, list(albums_dict.keys())):
-            for track in albums_dict[album.get('id')]:
-                track['genres'].extend([g for g in album.get('genres') if g not in track['genres']])
+        albums_genres = self.__genres(spotify_user, 'album', list(albums_dict.keys()), self.__spotify_port.get_albums)
+        for album_id, album_tracks in albums_dict.items():
+            for track in album_tracks:
+                track['genres'].extend([g for g in albums_genres.get(album_id, []) if g not in track['genres']])
 
-        for artist in self.__spotify_port.get_artists(spotify_user, list(artists_dict.keys())):
-            for track in artists_dict[artist.get('id')]:
-                track['genres'].extend([g for g in artist.get('genres') if g not in track['genres']])
+        artists_genres = self.__genres(spotify_user, 'artist', list(artists_dict.keys()),
+                                       self.__spotify_port.get_artists)
+        for artist_id, artist_tracks in artists_dict.items():
+            for track in artist_tracks:
+                track['genres'].extend([g for g in artists_genres.get(artist_id, []) if g not in track['genres']])
 
         # TODO: See if it is a good option to improve this
         return [SpotifyTrack(**t) for t in tracks]
 
+    def __fetch(self, spotify_user, snapshot=None):
+        """Fetch user library from Spotify reusing the tracks of a previous snapshot.
+
+        Saved tracks are obtained newest first, so paging stops once the remaining library tracks are the ones already
+        in the snapshot, and only the new tracks are enriched.
+        """
+        first_page, etag = self.__spotify_port.get_library_page(
+            spotify_user, etag=snapshot.etag if snapshot is not None else None)
+        if first_page is None:
+            return snapshot.refreshed()
+
+        total = first_page.get('total')
+        keys = []
+        new_tracks = {}
+        for item in self.__spotify_port.get_library_items(spotify_user, first_page):
+            key = self.__item_key(item)
+            position = snapshot.position(key) if snapshot is not None else None
+            if position is not None and len(keys) + len(snapshot) - position == total:
+                keys.extend(snapshot.keys[position:])
+                break
+            keys.append(key)
+            if position is None:
+                new_tracks[key] = item.get('track')
+
+        enriched_tracks = dict(zip(new_tracks, self.__enrich(spotify_user, list(new_tracks.values()))))
+        tracks = [enriched_tracks[k] if k in enriched_tracks else snapshot.tracks[snapshot.position(k)]
+                  for k in keys]
+        if snapshot is None:
+            return LibrarySnapshot(keys, tracks, etag)
+        # Keys are unique, so if all the snapshot tracks were kept none of them was removed
+        removed_keys = []
+        if len(keys) - len(new_tracks) != len(snapshot):
+            kept_keys = set(keys)
+            removed_keys = [k for k in snapshot.keys if k not in kept_keys]
+        return snapshot.changed(keys, tracks, etag, new_tracks, removed_keys)
+
+    @staticmethod
+    def __encode_rows(snapshot, keys):
+        """Get rows of the tracks of some snapshot keys to persist them in the snapshot store."""
+        return [(json.dumps(k), json.dumps(snapshot.track(k).__dict__, ensure_ascii=False)) for k in keys]
+
+    @staticmethod
+    def __decode_snapshot(version, etag, fetched_at, rows):
+        """Get library snapshot from its rows in the snapshot store."""
+        keys = []
+        tracks = []
+        for key, track in rows:
+            key = json.loads(key)
+            keys.append(tuple(key) if isinstance(key, list) else key)
+            tracks.append(SpotifyTrack(**json.loads(track)))
+        return LibrarySnapshot(keys, tracks, etag, fetched_at)
+
+    def __cached_snapshot(self, user_name):
+        """Get snapshot of a user library from the library cache or the snapshot store."""
+        snapshot = None
+        if self.__library_cache is not None:
+            snapshot = self.__library_cache.get(user_name)
+        if snapshot is None and self.__snapshot_store is not None:
+            stored_library = self.__snapshot_store.get(user_name)
+            if stored_library is not None:
+                snapshot = self.__decode_snapshot(*stored_library)
+            if snapshot is not None and self.__library_cache is not None:
+                self.__library_cache.set(user_name, snapshot)
+        return snapshot
+
+    def __store_snapshot(self, user_name, snapshot):
+        """Persist snapshot of a user library writing only the tracks added and removed since the stored one if known.
+
+        Tracks are added newest first, so the changes can only be written if the added tracks are the first ones.
+        """
+        base_version = snapshot.base_version
+        added_keys = snapshot.keys[:len(snapshot.added_keys)]
+        if set(added_keys) != set(snapshot.added_keys):
+            base_version = None
+        if not self.__snapshot_store.update(user_name, base_version, snapshot.version, snapshot.etag,
+                                            snapshot.fetched_at, self.__encode_rows(snapshot, added_keys),
+                                            [json.dumps(k) for k in snapshot.removed_keys]):
+            self.__snapshot_store.set(user_name, snapshot.version, snapshot.etag, snapshot.fetched_at,
+                                      self.__encode_rows(snapshot, snapshot.keys))
+
+    def __cache_snapshot(self, user_name, snapshot):
+        """Set snapshot of a user library in the library cache and the snapshot store."""
+        if self.__library_cache is not None:
+            self.__library_cache.set(user_name, snapshot)
+        if self.__snapshot_store is not None:
+            self.__store_snapshot(user_name, snapshot)
+
+    def __fresh(self, snapshot):
+        return snapshot is not None and time.time() - snapshot.fetched_at < self.__library_ttl
+
+    def __refresh(self, spotify_user, snapshot):
+        """Fetch user library from a previous snapshot, unless other request has already refreshed it."""
+        cached_snapshot = self.__cached_snapshot(spotify_user.name)
+        if self.__fresh(cached_snapshot):
+            return cached_snapshot
+        snapshot = self.__fetch(spotify_user, snapshot)
+        self.__cache_snapshot(spotify_user.name, snapshot)
+        return snapshot
+
+    def __get_snapshot(self, spotify_user):
+        if self.__library_cache is None and self.__snapshot_store is None:
+            return self.__single_flight.do((spotify_user.name, None), self.__fetch, spotify_user)
+
+        snapshot = self.__cached_snapshot(spotify_user.name)
+        if self.__fresh(snapshot):
+            return snapshot
+        return self.__single_flight.do((spotify_user.name, snapshot.version if snapshot is not None else None),
+                                       self.__refresh, spotify_user, snapshot)
+
+    def get_snapshot(self, spotify_user):
+        """Get snapshot of the user library."""
+        snapshot = None
+        # Streams closed before their end share no snapshot, so the library is requested again
+        while snapshot is None:
+            snapshot = self.__get_snapshot(spotify_user)
+        return snapshot
+
+    def stream(self, spotify_user, chunk_size=200):
+        """Get iterator of the user library tracks as they are obtained from Spotify.
+
+        Saved tracks are enriched in chunks of chunk size tracks, so they are returned without waiting for the whole
+        library. If the user library is already cached or being fetched its tracks are returned from it instead, and
+        otherwise the stream is the fetch of the library the requests that arrive meanwhile wait for.
+
+        The first page of the library is requested before the iterator is returned, so errors requesting it are
+        raised to the caller instead of while the tracks are being iterated.
+        """
+        if self.__cached_snapshot(spotify_user.name) is None:
+            key = (spotify_user.name, None)
+            call, leader = self.__single_flight.start(key)
+            if leader:
+                tracks = self.__stream(spotify_user, key, chunk_size)
+                # Run the stream up to its first page, so once started it finishes its fetch even if it is closed
+                next(tracks)
+                return tracks
+            snapshot = self.__single_flight.wait(call)
+            if snapshot is not None:
+                return iter(snapshot.tracks)
+        return iter(self.get_snapshot(spotify_user).tracks)
+
+    def __stream(self, spotify_user, key, chunk_size):
+        """Stream user library tracks and finish its fetch with the library snapshot, or None if it is not ended."""
+        snapshot = None
+        error = None
+        try:
+            first_page, etag = self.__spotify_port.get_library_page(spotify_user)
+            yield
+            items = self.__spotify_port.get_library_items(spotify_user, first_page)
+            keys = []
+            tracks = []
+            for chunk in iter(lambda: list(islice(items, chunk_size)), []):
+                chunk_tracks = self.__enrich(spotify_user, [i.get('track') for i in chunk])
+                keys.extend(self.__item_key(i) for i in chunk)
+                tracks.extend(chunk_tracks)
+                yield from chunk_tracks
+
+            snapshot = LibrarySnapshot(keys, tracks, etag)
+            self.__cache_snapshot(spotify_user.name, snapshot)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.__single_flight.finish(key, snapshot, error)
+
+    def execute(self, spotify_user):
+        """Execute use case."""
+        return self.get_snapshot(spotify_user).tracks
+
+    def get_page(self, spotify_user, limit, cursor=None, snapshot=None):
+        """Get a page of up to limit user library tracks after a cursor and the cursor of the next page.
+
+        The page is taken from the provided snapshot of the user library, like the one its version was obtained from,
+        or from the current one.
+        """
+        snapshot = snapshot if snapshot is not None else self.get_snapshot(spotify_user)
+        positions, next_cursor = snapshot.page(limit, cursor)
+        return [snapshot.tracks[i] for i in positions], next_cursor
+
 
 class GetFilterPreviewUseCase(object):
     """Get filter preview use case."""
@@ -98,13 +330,41 @@ class GetFilterPreviewUseCase(object):
         super().__init__()
         self.__get_user_track_library_user_case = get_user_track_library_user_case
 
-    def execute(self, spotify_user, filter_dict):
+    def get_snapshot(self, spotify_user):
+        """Get snapshot of the user library the filter preview is obtained from."""
+        return self.__get_user_track_library_user_case.get_snapshot(spotify_user)
+
+    def get_version(self, spotify_user, filter_dict, snapshot=None):
+        """Get version of the filter preview, that changes when the user library or the filter change.
+
+        Like the rest of methods, it is obtained from the provided snapshot of the user library or the current one.
+        """
+        track_filter = TrackFilter.fromDict(filter_dict)
+        snapshot = snapshot if snapshot is not None else self.get_snapshot(spotify_user)
+
+        return hashlib.sha1(f"{snapshot.version}:{filter_key(track_filter)}".encode()).hexdigest()
+
+    def execute(self, spotify_user, filter_dict, snapshot=None):
         """Execute use case."""
         track_filter = TrackFilter.fromDict(filter_dict)
-        tracks = self.__get_user_track_library_user_case.execute(spotify_user)
+        snapshot = snapshot if snapshot is not None else self.get_snapshot(spotify_user)
 
-        # TODO: See if it is a good option to improve this
-        return [t for t in tracks if t.match_filter(track_filter)]
+        return snapshot.index.filter(TrackFilterPlanner(snapshot.library).plan(track_filter))
+
+    def get_page(self, spotify_user, filter_dict, limit, cursor=None, snapshot=None):
+        """Get a page of up to limit tracks that match the filter after a cursor and the cursor of the next page."""
+        track_filter = TrackFilter.fromDict(filter_dict)
+        snapshot = snapshot if snapshot is not None else self.get_snapshot(spotify_user)
+        mask = snapshot.index.mask(TrackFilterPlanner(snapshot.library).plan(track_filter))
+        positions, next_cursor = snapshot.page(limit, cursor, np.flatnonzero(mask))
+        return [snapshot.tracks[i] for i in positions], next_cursor
+
+    def stream(self, spotify_user, filter_dict):
+        """Get tracks that match the filter as they are obtained from the user library."""
+        track_filter = TrackFilterPlanner().plan(TrackFilter.fromDict(filter_dict)).compile()
+        tracks = self.__get_user_track_library_user_case.stream(spotify_user)
+
+        return (t for t in tracks if track_filter(t))
 
 
 class GetPlaylistsUseCase(PersistenceUseCase):
@@ -118,6 +378,87 @@ class GetPlaylistsUseCase(PersistenceUseCase):
 
         return playlists
 
+    def get_version(self, user_name, playlists=None):
+        """Get version of the user playlists, from the provided ones or the current ones, without serializing them."""
+        if playlists is None:
+            playlists = self.execute(user_name)
+        digest = hashlib.sha1()
+        for playlist in playlists:
+            digest.update(f"\n{playlist.name}:{playlist.visibility}:{filter_key(playlist.track_filter)}".encode())
+        return digest.hexdigest()
+
+
+class GetPlaylistsTracksUseCase(PersistenceUseCase):
+    """Get tracks of all user playlists use case."""
+
+    def __init__(self, repository, get_user_track_library_user_case):
+        """Create get playlists tracks use case."""
+        super().__init__(repository)
+        self.__get_user_track_library_user_case = get_user_track_library_user_case
+
+    def __contents(self, playlist, snapshot):
+        """Get materialized contents of a playlist updated with the library changes or None if they are not known."""
+        if not self.repository.contains_by_id(PlaylistContents, playlist.id):
+            return None
+        contents = self.repository.find_by_id(PlaylistContents, playlist.id)
+        if contents.filter_key != filter_key(playlist.track_filter):
+            return None
+        if contents.library_version == snapshot.version:
+            return contents
+        changes = snapshot.changes_since(contents.library_version)
+        if changes is None:
+            return None
+
+        added_keys, removed_keys = changes
+        predicate = TrackFilterPlanner().plan(playlist.track_filter).compile()
+        added_keys = [k for k in added_keys if predicate(snapshot.track(k))]
+        contents = PlaylistContents(playlist.id, contents.filter_key, snapshot.version,
+                                    contents.track_keys.difference(removed_keys).union(added_keys))
+        self.repository.update(contents)
+        return contents
+
+    def get_version(self, spotify_user):
+        """Get version of the playlists tracks, that changes when the user library or the playlists change."""
+        user = self.get_user(spotify_user.name)
+        playlists = self.repository.find_by_filter(Playlist, {"owner": user})
+        digest = hashlib.sha1()
+        if playlists:
+            digest.update(self.__get_user_track_library_user_case.get_snapshot(spotify_user).version.encode())
+        for playlist in playlists:
+            digest.update(f"\n{playlist.name}:{filter_key(playlist.track_filter)}".encode())
+        return digest.hexdigest()
+
+    def execute(self, spotify_user):
+        """Execute use case.
+
+        Return a list with each user playlist and its tracks. Playlist contents are materialized in the repository,
+        so when the library changes only the added tracks are evaluated against the playlist filters. Playlists with
+        no contents for the library are evaluated together against the whole library, so the subfilters they share
+        are only evaluated once.
+        """
+        user = self.get_user(spotify_user.name)
+        playlists = self.repository.find_by_filter(Playlist, {"owner": user})
+        if not playlists:
+            return []
+        snapshot = self.__get_user_track_library_user_case.get_snapshot(spotify_user)
+
+        playlists_positions = []
+        planner = None
+        memo = {}
+        for playlist in playlists:
+            contents = self.__contents(playlist, snapshot)
+            if contents is None:
+                planner = planner if planner is not None else TrackFilterPlanner(snapshot.library)
+                positions = np.flatnonzero(snapshot.index.mask(planner.plan(playlist.track_filter), memo))
+                contents = PlaylistContents(playlist.id, filter_key(playlist.track_filter), snapshot.version,
+                                            [snapshot.keys[i] for i in positions])
+                self.repository.update(contents)
+            else:
+                positions = sorted(snapshot.position(k) for k in contents.track_keys)
+            playlists_positions.append(positions)
+
+        return [(p, [snapshot.tracks[i] for i in positions]) for p, positions in zip(playlists, playlists_positions)]
+
 
 class AddPlaylistUseCase(PersistenceUseCase):
     """Add playlist use case."""
@@ -128,6 +469,7 @@ class AddPlaylistUseCase(PersistenceUseCase):
         track_filter = TrackFilter.fromDict(track_filter_dict)
         playlist = Playlist(playlist_name, user, track_filter)
         self.repository.add(playlist)
+        self.invalidate_playlist_contents(playlist)
         return playlist
 
 
@@ -153,4 +495,5 @@ class RemovePlaylistUseCase(PersistenceUseCase):
         if not playlists:
             return None
         self.repository.remove(playlists[0])
+        self.invalidate_playlist_contents(playlists[0])
         return playlists[0]
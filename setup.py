@@ -4,5 +4,6 @@ setup(
     name='ipodify-api',
     version='1.0',
     packages=['ipodify_api'],
-    install_requires=[line for line in open('requirements.txt')]
+    install_requires=[line for line in open('requirements.txt')],
+    extras_require={'orjson': ['orjson']}
 )
\ No newline at end of file
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import pytest
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ipodify_api.cache import LRUCache, MetadataCache, LibrarySnapshotStore, SingleFlight, SingleFlightTimeoutException
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(5, weight=len)
+    cache.set("a", "aa")
+    cache.set("b", "bb")
+    assert cache.get("a") == "aa"
+    cache.set("c", "cc")
+    assert "b" not in cache
+    assert cache.get("a") == "aa"
+    assert cache.size == 4
+    cache.set("d", "dddddd")
+    assert "d" not in cache
+    assert len(cache) == 2
+    assert cache.pop("a") == "aa"
+    assert cache.size == 2
+
+
+def test_lru_cache_ttl():
+    clock = Clock()
+    cache = LRUCache(10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_metadata_cache(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    cache = MetadataCache(path=path)
+    cache.set_many("artist", {"a": ["pop"], "b": []})
+    assert cache.get_many("artist", ["a", "b", "c"]) == {"a": ["pop"], "b": []}
+    assert cache.get_many("album", ["a"]) == {}
+    assert MetadataCache(path=path).get_many("artist", ["a", "c"]) == {"a": ["pop"]}
+    assert MetadataCache(path=path, ttl=0).get_many("artist", ["a", "c"]) == {}
+
+
+def test_library_snapshot_store(tmp_path):
+    path = str(tmp_path / "cache.db")
+    store = LibrarySnapshotStore(path, max_size=2)
+    assert store.get("user") is None
+    assert not store.update("user", None, "1", '"1"', 10)
+    store.set("user", "1", '"1"', 10, [("b", "track b"), ("a", "track a")])
+    assert store.update("user", None, "1", '"2"', 20)
+    assert not store.update("user", "0", "2", '"3"', 30, [("c", "track c")])
+    assert store.update("user", "1", "2", '"3"', 30, [("d", "track d"), ("c", "track c")], ["b"])
+
+    stored_store = LibrarySnapshotStore(path)
+    assert stored_store.get("user") == ("2", '"3"', 30, [("d", "track d"), ("c", "track c"), ("a", "track a")])
+    store.pop("user")
+    assert store.get("user") is None
+
+    for i, user in enumerate(["a", "b", "c"]):
+        store.set(user, "1", None, i, [("a", "track a")])
+    assert store.get("a") is None
+    assert store.get("b") is not None and store.get("c") is not None
+
+
+def test_single_flight():
+    single_flight = SingleFlight(timeout=1)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def function(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        if value is None:
+            raise ValueError()
+        return value
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(single_flight.do, "a", function, 1)
+        started.wait()
+        assert single_flight.in_flight("a")
+        followers = [executor.submit(single_flight.do, "a", function, 2) for _ in range(3)]
+        time.sleep(0.1)
+        release.set()
+        assert [leader.result()] + [f.result() for f in followers] == [1, 1, 1, 1]
+    assert calls == [1]
+    assert not single_flight.in_flight("a")
+
+    started.clear()
+    release.clear()
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(single_flight.do, "b", function, None)
+        started.wait()
+        follower = executor.submit(single_flight.do, "b", function, 3)
+        time.sleep(0.1)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result()
+        with pytest.raises(ValueError):
+            follower.result()
+
+    release.clear()
+    single_flight = SingleFlight(timeout=0.01)
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(single_flight.do, "c", function, 4)
+        started.wait()
+        with pytest.raises(SingleFlightTimeoutException):
+            single_flight.do("c", function, 5)
+        release.set()
+        assert leader.result() == 4
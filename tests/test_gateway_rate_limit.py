@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import pytest
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ipodify_api.gateways.rate_limit import TokenBucket, FileTokenBucket, RateLimitScheduler, RaisablePriority, \
+                                            priority, BACKGROUND_PRIORITY
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.reserve() == 0
+    bucket.pause(3)
+    clock.now = 10
+    assert bucket.tokens == 2
+    assert bucket.reserve() == 0
+    assert TokenBucket().reserve() == 0
+
+
+def test_file_token_bucket(tmp_path):
+    path = str(tmp_path / "bucket")
+    assert FileTokenBucket(path, rate=0.1, capacity=1).reserve() == 0
+    assert FileTokenBucket(path, rate=0.1, capacity=1).reserve() > 0
+    FileTokenBucket(path).pause(60)
+    assert FileTokenBucket(path).reserve() > 59
+
+
+def test_rate_limit_scheduler_priority():
+    scheduler = RateLimitScheduler()
+    acquired = []
+
+    def acquire(name, priority_value=None):
+        scheduler.acquire(priority_value)
+        acquired.append(name)
+
+    def acquire_background(name):
+        with priority(BACKGROUND_PRIORITY):
+            acquire(name)
+
+    scheduler.retry_after(0.3)
+    with ThreadPoolExecutor(3) as executor:
+        executor.submit(acquire_background, "background")
+        time.sleep(0.05)
+        executor.submit(acquire, "interactive")
+        executor.submit(acquire, "interactive late", 5)
+        time.sleep(0.05)
+        assert scheduler.stats["queued_by_priority"] == {0: 1, 5: 1, BACKGROUND_PRIORITY: 1}
+    assert acquired == ["interactive", "interactive late", "background"]
+    assert scheduler.stats == {"queued": 0, "queued_by_priority": {}, "acquired": 3, "throttled": 1}
+
+
+def test_rate_limit_scheduler_raisable_priority():
+    scheduler = RateLimitScheduler()
+    raisable_priority = RaisablePriority(BACKGROUND_PRIORITY)
+    acquired = []
+
+    def acquire(name, priority_value):
+        scheduler.acquire(priority_value)
+        acquired.append(name)
+
+    scheduler.retry_after(0.3)
+    with ThreadPoolExecutor(2) as executor:
+        executor.submit(acquire, "prefetched", raisable_priority)
+        executor.submit(acquire, "interactive late", 5)
+        time.sleep(0.05)
+        assert scheduler.stats["queued_by_priority"] == {5: 1, BACKGROUND_PRIORITY: 1}
+        raisable_priority.raise_to(0)
+        raisable_priority.raise_to(BACKGROUND_PRIORITY)
+        assert scheduler.stats["queued_by_priority"] == {0: 1, 5: 1}
+    assert acquired == ["prefetched", "interactive late"]
+    assert raisable_priority.value == 0
+
+
+def test_rate_limit_scheduler_reserves_tokens_without_lock():
+    class SlowTokenBucket(TokenBucket):
+        reserving = threading.Event()
+        release = threading.Event()
+
+        def reserve(self):
+            self.reserving.set()
+            self.release.wait()
+            return super().reserve()
+
+    bucket = SlowTokenBucket()
+    scheduler = RateLimitScheduler(bucket)
+    with ThreadPoolExecutor(3) as executor:
+        first = executor.submit(scheduler.acquire)
+        bucket.reserving.wait()
+        second = executor.submit(scheduler.acquire)
+        time.sleep(0.05)
+        assert executor.submit(lambda: scheduler.stats).result(timeout=1)["queued"] == 2
+        bucket.release.set()
+        first.result()
+        second.result()
+    assert scheduler.stats["acquired"] == 2
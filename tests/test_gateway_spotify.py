@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import pytest
 
+import json
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from secrets import token_urlsafe
+from threading import Event, Thread
 
-from ipodify_api.gateways.spotify import SpotifyGateway, SpotifyUser
+from ipodify_api.gateways.rate_limit import RateLimitScheduler, RaisablePriority, BACKGROUND_PRIORITY, \
+                                            INTERACTIVE_PRIORITY, request_priority
+from ipodify_api.gateways.spotify import SpotifyGateway, SpotifyUser, SpotifyUserCache, SpotifyNotAuthenticatedError
 
 
 @pytest.fixture(scope="session")
@@ -29,4 +35,185 @@ def test_get_user(spotify_gateway, requests_mock):
     }
     requests_mock.get(f"{spotify_gateway.url}/v1/me", json=me)
     auth_token = token_urlsafe(32)
-    assert spotify_gateway.get_user(auth_token) == SpotifyUser("hombredeincognito", auth_token)
\ No newline at end of file
+    assert spotify_gateway.get_user(auth_token) == SpotifyUser("hombredeincognito", auth_token)
+
+
+def test_get_artists(spotify_gateway, requests_mock):
+    def artists(request, context):
+        return {"artists": [{"id": i, "genres": []} for i in request.qs["ids"][0].split(",")]}
+
+    requests_mock.get(f"{spotify_gateway.url}/v1/artists", json=artists)
+    artist_ids = [f"artist{i}" for i in range(120)]
+    spotify_user = SpotifyUser("hombredeincognito", token_urlsafe(32))
+    assert [a["id"] for a in spotify_gateway.get_artists(spotify_user, artist_ids)] == artist_ids
+    assert requests_mock.call_count == 3
+
+
+def test_get_albums_rate_limited(spotify_gateway, requests_mock):
+    requests_mock.get(f"{spotify_gateway.url}/v1/albums", [
+        {"status_code": 429, "headers": {"Retry-After": "0"}},
+        {"json": {"albums": [{"id": "album", "genres": ["pop"]}]}}
+    ])
+    spotify_user = SpotifyUser("hombredeincognito", token_urlsafe(32))
+    throttled = spotify_gateway.scheduler.stats["throttled"]
+    assert list(spotify_gateway.get_albums(spotify_user, ["album"])) == [{"id": "album", "genres": ["pop"]}]
+    assert requests_mock.call_count == 2
+    assert spotify_gateway.scheduler.stats["throttled"] == throttled + 1
+
+
+def test_get_library_tracks(spotify_gateway, requests_mock):
+    total = 230
+
+    def tracks(request, context):
+        offset, limit = int(request.qs["offset"][0]), int(request.qs["limit"][0])
+        return {
+            "items": [{"added_at": "2020-03-08T17:46:03Z", "track": {"uri": f"spotify:track:{i}"}}
+                      for i in range(offset, min(offset + limit, total))],
+            "next": "next" if offset + limit < total else None,
+            "offset": offset,
+            "limit": limit,
+            "total": total
+        }
+
+    class Scheduler(RateLimitScheduler):
+        priorities = []
+
+        def acquire(self, priority=None):
+            self.priorities.append(request_priority.get())
+            super().acquire(priority)
+
+    spotify_gateway = SpotifyGateway(spotify_gateway.url, max_workers=2, scheduler=Scheduler())
+    requests_mock.get(f"{spotify_gateway.url}/v1/me/tracks", json=tracks)
+    spotify_user = SpotifyUser("hombredeincognito", token_urlsafe(32))
+    assert [t["uri"] for t in spotify_gateway.get_library_tracks(spotify_user)] == \
+        [f"spotify:track:{i}" for i in range(total)]
+    assert requests_mock.call_count == 5
+    # Prefetched pages are requested with background priority, that is raised to the one of the caller once needed
+    priorities = spotify_gateway.scheduler.priorities
+    assert priorities[0] == INTERACTIVE_PRIORITY
+    assert all(isinstance(p, RaisablePriority) for p in priorities[1:])
+    assert [p.value for p in priorities[1:]] == [INTERACTIVE_PRIORITY] * 4
+
+    items = spotify_gateway.get_library_items(spotify_user)
+    assert len([i for _, i in zip(range(60), items)]) == 60
+    items.close()
+    # Only the page that was needed is raised, pages prefetched after it keep background priority
+    page_priorities = sorted(p.value for p in priorities[6:])
+    assert page_priorities == [INTERACTIVE_PRIORITY] + [BACKGROUND_PRIORITY] * (len(page_priorities) - 1)
+    assert len(page_priorities) >= 2
+
+
+def test_get_library_items_cancel_pages(requests_mock):
+    total = 1000
+    offsets = []
+    occupied = Event()
+    release = Event()
+    released = Event()
+
+    def tracks(request, context):
+        offset, limit = int(request.qs["offset"][0]), int(request.qs["limit"][0])
+        offsets.append(offset)
+        if offset == 100:
+            release.wait(5)
+            released.set()
+        return {
+            "items": [{"added_at": "2020-03-08T17:46:03Z", "track": {"uri": f"spotify:track:{i}"}}
+                      for i in range(offset, min(offset + limit, total))],
+            "next": "next" if offset + limit < total else None,
+            "offset": offset,
+            "limit": limit,
+            "total": total
+        }
+
+    def artists(request, context):
+        occupied.set()
+        release.wait(5)
+        return {"artists": [{"id": "artist", "genres": []}]}
+
+    spotify_gateway = SpotifyGateway("http://mockspotify", max_workers=2)
+    requests_mock.get(f"{spotify_gateway.url}/v1/me/tracks", json=tracks)
+    requests_mock.get(f"{spotify_gateway.url}/v1/artists", json=artists)
+    spotify_user = SpotifyUser("hombredeincognito", token_urlsafe(32))
+    # Other user request keeps a worker busy, so pages are queued until a worker is free
+    other_request = Thread(target=lambda: list(spotify_gateway.get_artists(spotify_user, ["artist"])))
+    other_request.start()
+    assert occupied.wait(5)
+
+    items = spotify_gateway.get_library_items(spotify_user)
+    assert len([i for _, i in zip(range(60), items)]) == 60
+    items.close()
+    release.set()
+    other_request.join()
+    # The page after the next one may be cancelled before a worker takes it, the rest are always cancelled
+    if 100 in offsets:
+        assert released.wait(5)
+    assert list(spotify_gateway.get_artists(spotify_user, ["artist"])) == [{"id": "artist", "genres": []}]
+    assert sorted(offsets) in ([0, 50], [0, 50, 100])
+
+
+def test_pool_stats():
+    client_addresses = []
+
+    class MeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            client_addresses.append(self.client_address)
+            body = json.dumps({"id": "hombredeincognito"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MeHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        spotify_gateway = SpotifyGateway(f"http://127.0.0.1:{server.server_port}")
+        assert spotify_gateway.pool_stats == []
+        for _ in range(3):
+            spotify_gateway.get_user(token_urlsafe(32))
+        assert spotify_gateway.pool_stats == [{
+            "host": "127.0.0.1",
+            "port": server.server_port,
+            "connections": 1,
+            "requests": 3,
+            "idle_connections": 1
+        }]
+        assert len(client_addresses) == 3
+        assert len(set(client_addresses)) == 1
+    finally:
+        server.shutdown()
+
+
+def test_spotify_user_cache():
+    calls = []
+    loading = Event()
+
+    def get_user(authorization):
+        calls.append(authorization)
+        loading.wait(1)
+        if authorization == "invalid":
+            raise SpotifyNotAuthenticatedError()
+        return SpotifyUser("hombredeincognito", authorization)
+
+    spotify_user_cache = SpotifyUserCache()
+    users = []
+    threads = [Thread(target=lambda: users.append(spotify_user_cache.get_user("valid", get_user)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    loading.set()
+    for thread in threads:
+        thread.join()
+    assert users == [SpotifyUser("hombredeincognito", "valid")] * 5
+    assert spotify_user_cache.get_user("valid", get_user) is users[0]
+    assert calls == ["valid"]
+
+    for _ in range(2):
+        with pytest.raises(SpotifyNotAuthenticatedError):
+            spotify_user_cache.get_user("invalid", get_user)
+    assert calls == ["valid", "invalid"]
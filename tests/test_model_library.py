@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ipodify_api.model.library import TrackLibrary, TrackIndex, MultiValuedColumn, NumericColumn, LibrarySnapshot, \
+                                     InvalidCursorException, MAX_SNAPSHOT_DELTAS, encode_cursor, filter_key
+from ipodify_api.model.track import Track, TrackFilter
+
+
+@pytest.fixture
+def tracks():
+    return [
+        Track("Blue (Da Ba Dee)", "ITT019810102", "Europop", 1999, "English", ["Eiffel 65"],
+              ["eurodance", "europop", "italo dance"]),
+        Track("Move Your Body", "ITT019910103", "Europop", 1999, "English", ["Eiffel 65"], ["eurodance"]),
+        Track("Clandestino", "FRZ039800212", "Clandestino", 1998, "Spanish", ["Manu Chao"], None),
+        Track("Salir", "ES5020200101", "Yo, minoría absoluta", 2002, "Spanish", ["Extremoduro"],
+              ["spanish rock", "rock"]),
+        Track("Esta noche", "ES5020200102", "Correos", 2011, "Spanish", ["Platero y Tú", "Extremoduro"],
+              ["spanish rock"])
+    ]
+
+
+def test_multi_valued_column():
+    column = MultiValuedColumn([["a", "b"], [], ["b"], ["c", "a", "b"]])
+    assert column.dictionary == ["a", "b", "c"]
+    assert list(column.offsets) == [0, 2, 2, 3, 6]
+    assert list(column.mask(lambda v: v == "b")) == [True, False, True, True]
+    assert list(column.mask(lambda v: v != "c", all)) == [True, True, True, False]
+    assert column.count(["a", "b", "d", ["a"]]) == 5
+
+
+def test_numeric_column(monkeypatch):
+    column = NumericColumn([1999, 2002, 1998])
+    monkeypatch.setattr(column, "mask", None)
+    assert list(column.filter_mask(TrackFilter.fromDict({"$ge": {"release_year": 1999}}))) == [True, True, False]
+    assert list(column.filter_mask(TrackFilter.fromDict({"$ne": {"release_year": 2002.0}}))) == [True, False, True]
+    assert [column.count_range(o, 1999) for o in ["$gt", "$ge", "$lt", "$le"]] == [1, 2, 1, 2]
+    assert NumericColumn([1999, None]).count_range("$gt", 1998) is None
+    assert list(NumericColumn([1999, None]).filter_mask(TrackFilter.fromDict({"$eq": {"release_year": 1999}}))) == \
+        [True, False]
+
+
+@pytest.mark.parametrize("filter_dict", [
+    {"$eq": {"album": "Europop"}},
+    {"$ne": {"artists": "Extremoduro"}},
+    {"$eq": {"genres": "spanish rock"}},
+    {"$nmatch": {"genres": "^euro"}},
+    {"$in": {"artists": ["Manu Chao", "Platero y Tú"]}},
+    {"$ni": {"language": ["English"]}},
+    {"$gt": {"release_year": 1999}},
+    {"$le": {"release_year": 1999}},
+    {"$lt": {"release_year": 1998}},
+    {"$ge": {"release_year": 2011}},
+    {"$eq": {"release_year": 2002}},
+    {"$ne": {"artists": "Platero y Tú"}},
+    {"$in": {"album": []}},
+    {"$lt": {"album": "D"}},
+    {"$and": []},
+    {"$or": []},
+    {"$and": [{"$ge": {"release_year": 1999}}, {"$lt": {"release_year": 2010}}]},
+    {"$or": [{"$match": {"name": "^S"}}, {"$eq": {"album": "Europop"}}, {"$not": {"$eq": {"language": "English"}}}]},
+    {"$not": {"$and": [{"$eq": {"language": "Spanish"}}, {"$or": [{"$eq": {"genres": "rock"}}]}]}}
+])
+def test_library_filter(tracks, filter_dict):
+    track_filter = TrackFilter.fromDict(filter_dict)
+    library = TrackLibrary(tracks)
+    assert library.filter(track_filter) == [t for t in tracks if t.match_filter(track_filter)]
+    assert TrackIndex(library).filter(track_filter) == [t for t in tracks if t.match_filter(track_filter)]
+
+
+def test_track_index_postings(tracks):
+    index = TrackIndex(TrackLibrary(tracks))
+    assert {k: list(v) for k, v in index.postings("artists").items()} == {
+        "Eiffel 65": [0, 1],
+        "Manu Chao": [2],
+        "Extremoduro": [3, 4],
+        "Platero y Tú": [4]
+    }
+    assert list(index.postings("release_year")[1999]) == [0, 1]
+
+
+def test_filter_key():
+    assert filter_key(TrackFilter.fromDict({"$and": [{"$eq": {"album": "a"}}, {"$in": {"genres": ["b", "c"]}}]})) == \
+        filter_key(TrackFilter.fromDict({"$and": [{"$in": {"genres": ["c", "b"]}}, {"$eq": {"album": "a"}}]}))
+    assert filter_key(TrackFilter.fromDict({"$eq": {"album": "a"}})) != \
+        filter_key(TrackFilter.fromDict({"$ne": {"album": "a"}}))
+
+
+def test_track_index_filter_many(tracks):
+    filter_dicts = [
+        {"$and": [{"$eq": {"language": "Spanish"}}, {"$gt": {"release_year": 2000}}]},
+        {"$and": [{"$gt": {"release_year": 2000}}, {"$eq": {"genres": "rock"}}]},
+        {"$not": {"$eq": {"language": "Spanish"}}}
+    ]
+    track_filters = [TrackFilter.fromDict(d) for d in filter_dicts]
+    memo = {}
+    index = TrackIndex(TrackLibrary(tracks))
+    assert index.filter_many(track_filters) == [[t for t in tracks if t.match_filter(f)] for f in track_filters]
+    for track_filter in track_filters:
+        index.mask(track_filter, memo)
+    assert len(memo) == 6
+
+
+def test_library_snapshot_page(tracks):
+    keys = [("2020-01-0{}".format(5 - i), str(i)) for i in range(5)]
+    snapshot = LibrarySnapshot(keys[1:], tracks[1:])
+    positions, cursor = snapshot.page(2)
+    assert list(positions) == [0, 1]
+    new_snapshot = LibrarySnapshot(keys, tracks)
+    positions, cursor = new_snapshot.page(2, cursor)
+    assert list(positions) == [3, 4]
+    assert cursor is None
+    positions, cursor = new_snapshot.page(1, None, [1, 3, 4])
+    assert list(positions) == [1]
+    assert list(new_snapshot.page(1, cursor, [1, 3, 4])[0]) == [3]
+    assert list(LibrarySnapshot(keys[2:], tracks[2:]).page(1, snapshot.page(1)[1])[0]) == [0]
+    assert list(LibrarySnapshot(keys[:1] + keys[2:], tracks[:1] + tracks[2:]).page(1, cursor)[0]) == [1]
+    # Tracks saved at the same time as a removed cursor track may have been returned already
+    same_date_keys = [("2020-01-05", "0"), ("2020-01-04", "2"), ("2020-01-04", "1"), ("2020-01-03", "3")]
+    same_date_snapshot = LibrarySnapshot(same_date_keys, tracks[:4])
+    positions, cursor = same_date_snapshot.page(2)
+    with pytest.raises(InvalidCursorException):
+        LibrarySnapshot(same_date_keys[:1] + same_date_keys[2:], tracks[:1] + tracks[2:]).page(2, cursor)
+    positions, cursor = same_date_snapshot.page(3)
+    with pytest.raises(InvalidCursorException):
+        LibrarySnapshot(same_date_keys[:2], tracks[:2]).page(2, cursor)
+    removed_date_keys = same_date_keys[:1] + same_date_keys[3:]
+    assert list(LibrarySnapshot(removed_date_keys, tracks[:1] + tracks[3:]).page(2, cursor)[0]) == [1]
+    with pytest.raises(InvalidCursorException):
+        LibrarySnapshot(["2", "3"], tracks[:2]).page(1, LibrarySnapshot(["1", "2"], tracks[:2]).page(1)[1])
+    with pytest.raises(InvalidCursorException):
+        snapshot.page(1, "not a cursor")
+    for key in [{}, [], [[1]], [{}], 1]:
+        with pytest.raises(InvalidCursorException):
+            snapshot.page(1, encode_cursor(key))
+    with pytest.raises(InvalidCursorException):
+        snapshot.page(1, encode_cursor(["2020-01-03"]))
+
+
+def test_library_snapshot_deltas(tracks):
+    snapshot = LibrarySnapshot(["1", "2", "3"], tracks[:3])
+    assert snapshot.changes_since(snapshot.version) == (set(), set())
+    second_snapshot = snapshot.changed(["4", "1", "3"], [tracks[3], tracks[0], tracks[2]], None, ["4"], ["2"])
+    third_snapshot = second_snapshot.changed(["5", "1", "3"], [tracks[4], tracks[0], tracks[2]], None, ["5"], ["4"])
+    assert third_snapshot.base_version == second_snapshot.version
+    assert third_snapshot.changes_since(second_snapshot.version) == ({"5"}, {"4"})
+    assert third_snapshot.changes_since(snapshot.version) == ({"5"}, {"2"})
+    assert third_snapshot.refreshed().changes_since(snapshot.version) == ({"5"}, {"2"})
+    assert third_snapshot.changes_since(LibrarySnapshot(["6"], tracks[:1]).version) is None
+    for i in range(MAX_SNAPSHOT_DELTAS - 1):
+        key = str(6 + i)
+        third_snapshot = third_snapshot.changed([key] + third_snapshot.keys, tracks[:1] + third_snapshot.tracks, None,
+                                                [key])
+    assert third_snapshot.changes_since(second_snapshot.version) is not None
+    assert third_snapshot.changes_since(snapshot.version) is None
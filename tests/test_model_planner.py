@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ipodify_api.model.library import TrackLibrary, CategoricalColumn
+from ipodify_api.model.planner import TrackFilterPlanner
+from ipodify_api.model.track import Track, TrackFilter
+
+
+@pytest.fixture
+def tracks():
+    return [
+        Track("Blue (Da Ba Dee)", "ITT019810102", "Europop", 1999, "English", ["Eiffel 65"],
+              ["eurodance", "europop", "italo dance"]),
+        Track("Move Your Body", "ITT019910103", "Europop", 1999, "English", ["Eiffel 65"], ["eurodance"]),
+        Track("Clandestino", "FRZ039800212", "Clandestino", 1998, "Spanish", ["Manu Chao"], None),
+        Track("Salir", "ES5020200101", "Yo, minoría absoluta", 2002, "Spanish", ["Extremoduro"],
+              ["spanish rock", "rock"]),
+        Track("Esta noche", "ES5020200102", "Correos", 2011, "Spanish", ["Platero y Tú", "Extremoduro"],
+              ["spanish rock"])
+    ]
+
+
+@pytest.mark.parametrize("filter_dict,planned_filter_dict", [
+    ({"$not": {"$not": {"$eq": {"album": "Europop"}}}}, {"$eq": {"album": "Europop"}}),
+    ({"$not": {"$or": [{"$eq": {"artists": "Manu Chao"}}, {"$match": {"name": "^S"}}]}},
+     {"$and": [{"$ne": {"artists": "Manu Chao"}}, {"$nmatch": {"name": "^S"}}]}),
+    ({"$not": {"$gt": {"release_year": 2000}}}, {"$le": {"release_year": 2000}}),
+    ({"$not": {"$gt": {"genres": "rock"}}}, {"$not": {"$gt": {"genres": "rock"}}}),
+    ({"$or": [{"$eq": {"album": "Europop"}}, {"$or": [{"$in": {"album": ["Correos", "Europop"]}},
+                                                      {"$eq": {"language": "French"}}]}]},
+     {"$or": [{"$in": {"album": ["Europop", "Correos"]}}, {"$eq": {"language": "French"}}]}),
+    ({"$not": {"$or": [{"$eq": {"artists": "Extremoduro"}}, {"$eq": {"artists": "Manu Chao"}}]}},
+     {"$ni": {"artists": ["Extremoduro", "Manu Chao"]}}),
+    ({"$and": [{"$match": {"name": "^S"}}, {"$ge": {"release_year": 2000}}]},
+     {"$and": [{"$ge": {"release_year": 2000}}, {"$match": {"name": "^S"}}]})
+])
+def test_plan(filter_dict, planned_filter_dict):
+    assert TrackFilterPlanner().plan(TrackFilter.fromDict(filter_dict)).__dict__ == planned_filter_dict
+
+
+@pytest.mark.parametrize("filter_dict", [
+    {"$and": [{"$eq": {"language": "Spanish"}}, {"$eq": {"album": "Europop"}}, {"$match": {"genres": "rock$"}}]},
+    {"$or": [{"$eq": {"language": "English"}}, {"$eq": {"artists": "Manu Chao"}}, {"$lt": {"release_year": 1999}}]},
+    {"$not": {"$and": [{"$or": [{"$eq": {"genres": "rock"}}, {"$eq": {"genres": "eurodance"}}]},
+                       {"$not": {"$ge": {"release_year": 2000}}}]}},
+    {"$and": [{"$ne": {"artists": "Eiffel 65"}}, {"$ni": {"artists": ["Manu Chao"]}}, {"$and": []}]},
+    {"$or": [{"$or": []}, {"$not": {"$le": {"genres": "rock"}}}]}
+])
+def test_planned_filters_match(tracks, filter_dict):
+    track_filter = TrackFilter.fromDict(filter_dict)
+    library = TrackLibrary(tracks)
+    for planner in [TrackFilterPlanner(), TrackFilterPlanner(library)]:
+        planned_filter = planner.plan(track_filter)
+        assert [t.match_filter(planned_filter) for t in tracks] == [t.match_filter(track_filter) for t in tracks]
+        assert library.filter(planned_filter) == library.filter(track_filter)
+
+
+def test_plan_with_library_statistics(tracks):
+    track_filter = TrackFilter.fromDict({"$and": [{"$eq": {"language": "Spanish"}}, {"$eq": {"album": "Correos"}}]})
+    assert TrackFilterPlanner().plan(track_filter).__dict__ == track_filter.__dict__
+    assert TrackFilterPlanner(TrackLibrary(tracks)).plan(track_filter).__dict__ == \
+        {"$and": [{"$eq": {"album": "Correos"}}, {"$eq": {"language": "Spanish"}}]}
+
+
+def test_plan_with_library_statistics_does_not_evaluate_filters(tracks, monkeypatch):
+    library = TrackLibrary(tracks)
+    track_filter = TrackFilter.fromDict({"$and": [{"$match": {"name": "^S"}}, {"$in": {"artists": ["Eiffel 65"]}},
+                                                  {"$ge": {"release_year": 2011}}]})
+
+    def dictionary_mask(self, predicate):
+        raise AssertionError("Filter evaluated while planning")
+
+    monkeypatch.setattr(CategoricalColumn, "dictionary_mask", dictionary_mask)
+    assert TrackFilterPlanner(library).plan(track_filter).__dict__ == \
+        {"$and": [{"$ge": {"release_year": 2011}}, {"$in": {"artists": ["Eiffel 65"]}}, {"$match": {"name": "^S"}}]}
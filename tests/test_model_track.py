@@ -4,7 +4,8 @@ import pytest
 import json
 
 from ipodify_api.model.playlist import Playlist
-from ipodify_api.model.track import Track, TrackFilter, TrackAggregateFilter, TrackPropertyFilter, TrackNotFilter
+from ipodify_api.model.track import Track, SpotifyTrack, TrackFilter, TrackAggregateFilter, TrackPropertyFilter, \
+                                    TrackNotFilter, InvalidFilterValueException, _compile_regex
 from ipodify_api.model.user import User
 
 
@@ -110,3 +111,74 @@ def test_playlists(basic_filter):
     playlist3 = Playlist("playlist3", user, basic_filter)
 
     assert user.playlists == [playlist1, playlist2, playlist3]
+
+
+def test_compiled_filters():
+    track_params = {
+        "name": "Blue (Da Ba Dee) - Gabry Ponte Ice Pop Radio",
+        "isrc": "ITT019810102",
+        "release_year": 2011,
+        "album": "Europop",
+        "language": "English",
+        "artists": ["Eiffel 65", "Gabry Ponte"],
+        "genres": ["bubblegum dance", "eurodance", "europop", "italian pop", "italo dance"]
+    }
+    track = Track(**track_params)
+    no_genres_track = Track(**dict(track_params, genres=None))
+    track_filters = [
+        TrackPropertyFilter("$eq", "artists", "Eiffel 65"),
+        TrackPropertyFilter("$ne", "artists", "Extremoduro"),
+        TrackPropertyFilter("$nmatch", "name", "^Blue .*$"),
+        TrackPropertyFilter("$match", "genres", "^.*jazz.*$"),
+        TrackPropertyFilter("$in", "album", ["Europop", "Desaparecido"]),
+        TrackPropertyFilter("$ni", "artists", ["Gabry Ponte", "Extremoduro"]),
+        TrackPropertyFilter("$ni", "genres", ["eurodance"]),
+        TrackAggregateFilter("$and", []),
+        TrackAggregateFilter("$or", []),
+        TrackAggregateFilter("$or", [TrackPropertyFilter("$eq", "language", "Spanish")]),
+        TrackAggregateFilter("$and", [TrackPropertyFilter("$ge", "release_year", 2010),
+                                      TrackAggregateFilter("$and", [TrackPropertyFilter("$lt", "release_year", 2020),
+                                                                    TrackPropertyFilter("$eq", "album", "Europop")])]),
+        TrackNotFilter(TrackAggregateFilter("$or", [TrackPropertyFilter("$eq", "album", "Veneno"),
+                                                    TrackPropertyFilter("$eq", "language", "Spanish"),
+                                                    TrackPropertyFilter("$match", "artists", "^Eiffel")]))
+    ]
+    for track_filter in track_filters:
+        predicate = track_filter.compile()
+        assert predicate(track) == track.match_filter(track_filter)
+        assert predicate(no_genres_track) == no_genres_track.match_filter(track_filter)
+
+
+def test_regex_filters():
+    with pytest.raises(InvalidFilterValueException):
+        TrackFilter.fromDict({"$match": {"name": "^Blue ($"}})
+    with pytest.raises(InvalidFilterValueException):
+        TrackFilter.fromDict({"$and": [{"$eq": {"album": "Europop"}}, {"$nmatch": {"genres": "*pop"}}]})
+
+    hits = _compile_regex.cache_info().hits
+    TrackFilter.fromDict({"$match": {"name": "^Blue .*$"}})
+    TrackFilter.fromDict({"$nmatch": {"artists": "^Blue .*$"}})
+    assert _compile_regex.cache_info().hits >= hits + 1
+
+
+def test_compact_tracks():
+    track_params = {
+        "uri": "spotify:track:2yAVzRiEQooPEJ9SYx11L3",
+        "href": "https://api.spotify.com/v1/tracks/2yAVzRiEQooPEJ9SYx11L3",
+        "name": "Blue (Da Ba Dee) - Gabry Ponte Ice Pop Radio",
+        "isrc": "ITT019810102",
+        "release_year": 2011,
+        "album": "Europop",
+        "language": "English",
+        "artists": ["Eiffel 65", "Gabry Ponte"],
+        "genres": ["bubblegum dance", "eurodance", "europop", "italian pop", "italo dance"]
+    }
+    track = SpotifyTrack(**track_params)
+    other_track = SpotifyTrack(**dict(track_params, name="Blue (Da Ba Dee)", album="".join(["Euro", "pop"])))
+    assert track.__dict__ == track_params
+    assert track.artists == ("Eiffel 65", "Gabry Ponte")
+    assert track.genres is other_track.genres
+    assert track.album is other_track.album
+    assert Track("Europop", None, "Europop", 1999, "English", "Eiffel 65", None).artists == ("Eiffel 65",)
+    with pytest.raises(AttributeError):
+        track.bpm = 128
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import pytest
 
+from sqlalchemy import event
+
 from ipodify_api.model.user import User
 from ipodify_api.model.playlist import Playlist
-from ipodify_api.model.track import TrackPropertyFilter
+from ipodify_api.model.track import TrackPropertyFilter, TrackFilter
 
-from ipodify_api.repositories.memory import MemoryRepository, filter_match
-from ipodify_api.repositories.sql import SQLRepository, EntityMap, UserMap, PlaylistMap
+from ipodify_api.repositories.memory import MemoryRepository, filter_match, clone
+from ipodify_api.repositories.sql import SQLRepository, EntityMap, UserMap, PlaylistMap, SQL_BATCH_SIZE
 
 
 def test_filter_match():
@@ -15,6 +17,13 @@ def test_filter_match():
                         Playlist("a", User("b"), TrackPropertyFilter("$eq", "album", "Veneno")))
 
 
+def test_clone():
+    playlist = Playlist("a", User("b"), TrackPropertyFilter("$eq", "album", "Veneno"))
+    cloned_playlist = clone(playlist)
+    assert cloned_playlist is not playlist
+    assert cloned_playlist.__dict__ == playlist.__dict__
+
+
 def test_entity_map():
     assert PlaylistMap.get_entity() == Playlist
     assert PlaylistMap.get_map(User) == UserMap
@@ -53,4 +62,89 @@ def test_repository_with_composed_entity(repository):
     repository.update(playlist)
     same_playlist = repository.find_by_id(Playlist, "a:b")
     print(same_playlist)
-    #print(playlists_by_name)
\ No newline at end of file
+    #print(playlists_by_name)
+
+
+def test_memory_repository_indexes():
+    repository = MemoryRepository({Playlist: [("owner",), ("owner", "name")]})
+    a, b = User("a"), User("b")
+    playlists = [Playlist(n, u, TrackPropertyFilter("$eq", "album", "Veneno")) for n in ["x", "y"] for u in [a, b]]
+    repository.add(*playlists)
+    assert repository.find_by_filter(Playlist, {"owner": a}) == [playlists[0], playlists[2]]
+    assert repository.find_by_filter(Playlist, {"owner": b, "name": "y"}) == [playlists[3]]
+    assert repository.find_by_filter(Playlist, {"name": "y", "visibility": playlists[0].visibility}) == \
+        [playlists[2], playlists[3]]
+    assert repository.find_by_filter(Playlist, {"owner": User("c")}) == []
+
+    repository.update(Playlist("x", a, TrackPropertyFilter("$eq", "album", "Agila")))
+    assert repository.find_by_filter(Playlist, {"owner": a, "name": "x"})[0].track_filter.value == "Agila"
+    repository.remove_by_filter(Playlist, {"owner": a})
+    assert repository.find_by_filter(Playlist, {"owner": a}) == []
+    assert repository.find_by_filter(Playlist, {"owner": a, "name": "x"}) == []
+    assert repository.count(Playlist) == 2
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_memory_repository_add_many(copy):
+    repository = MemoryRepository({User: [("name",)]}, copy=copy)
+    users = [User(str(i)) for i in range(10)]
+    repository.add_many(iter(users))
+    assert repository.count(User) == 10
+    assert repository.find_by_filter(User, {"name": "5"}) == [users[5]]
+    assert (repository.find_by_id(User, "5") is users[5]) is not copy
+
+
+@pytest.mark.parametrize("repository", [MemoryRepository(), SQLRepository()])
+def test_repository_bulk_operations(repository):
+    users = [User(str(i)) for i in range(3)]
+    playlists = [Playlist(n, u, TrackPropertyFilter("$eq", "album", "Veneno")) for u in users for n in ["x", "y"]]
+    repository.add_many(users + playlists)
+    assert repository.count(Playlist) == 6
+    assert repository.contains_by_id(Playlist, "1:y")
+    assert not repository.contains_by_id(Playlist, "1:z")
+    with pytest.raises(KeyError):
+        repository.find_by_id(Playlist, "1:z")
+    assert [p.id for p in repository.find_by_ids(Playlist, ["2:x", "1:z", "0:y"])] == ["2:x", "0:y"]
+    assert [p.id for p in repository.find_by_filter(Playlist, {"owner": users[1]})] == ["1:x", "1:y"]
+
+    repository.update(Playlist("x", users[0], TrackFilter.fromDict({"$not": {"$eq": {"album": "Agila"}}})),
+                      Playlist("z", users[0], TrackPropertyFilter("$eq", "album", "Agila")))
+    assert repository.find_by_id(Playlist, "0:x").track_filter.__dict__ == {"$not": {"$eq": {"album": "Agila"}}}
+    assert repository.count(Playlist) == 7
+
+    repository.remove_by_ids(Playlist, ["0:x", "0:z", "2:y"])
+    assert repository.count(Playlist) == 4
+    repository.remove(*repository.find_by_filter(Playlist, {"owner": users[1]}))
+    assert repository.count(Playlist) == 2
+    assert [p.id for p in repository.find_by_ids(Playlist, ["0:x", "0:y", "1:x", "2:x", "2:y"])] == ["0:y", "2:x"]
+
+
+def test_sql_repository_statements():
+    repository = SQLRepository()
+    statements = []
+    event.listen(repository.session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    users = [User(str(i)) for i in range(1000)]
+    repository.add_many(users)
+    repository.add_many(Playlist(n, u, TrackPropertyFilter("$eq", "album", "Veneno")) for u in users for n in "xy")
+    assert len(statements) == 2
+    assert len(repository.find_by_ids(User, [u.id for u in users])) == 1000
+    assert len(statements) == 4
+    repository.remove_by_ids(Playlist, [f"{u.id}:x" for u in users[:500]])
+    assert len(statements) == 6
+    assert repository.count(Playlist) == 1500
+
+
+def test_sql_repository_statement_variables():
+    repository = SQLRepository()
+    variables = []
+    # Parameters of executemany statements are a list of rows instead of the variables of a single statement
+    event.listen(repository.session.bind, "before_cursor_execute",
+                 lambda *args: variables.append(len(args[3][0]) if args[5] else len(args[3])))
+    users = [User(str(i)) for i in range(600)]
+    playlists = [Playlist(n, u, TrackPropertyFilter("$eq", "album", "Veneno")) for u in users for n in "xy"]
+    repository.add_many(users + playlists)
+    ids = [p.id for p in playlists]
+    assert [p.id for p in repository.find_by_ids(Playlist, ids)] == ids
+    repository.remove_by_ids(Playlist, ids[:1100])
+    assert repository.count(Playlist) == 100
+    assert max(variables) <= SQL_BATCH_SIZE
@@ -2,14 +2,26 @@
 import pytest
 
 import inject
+import json
 from urllib.parse import urlparse
 
 from secrets import token_urlsafe
 
 from ipodify_api.app import create_app
 from ipodify_api.gateways.spotify import SpotifyGateway, SpotifyUser
+from ipodify_api.model.library import LibrarySnapshot
+from ipodify_api.model.track import SpotifyTrack
 from ipodify_api.repositories.memory import MemoryRepository
-from ipodify_api.use_cases import GetPlaylistsUseCase, AddPlaylistUseCase, GetPlaylistUseCase, RemovePlaylistUseCase
+from ipodify_api.use_cases import GetPlaylistsUseCase, AddPlaylistUseCase, GetPlaylistUseCase, RemovePlaylistUseCase, \
+                                  GetLibraryUseCase, GetFilterPreviewUseCase, GetPlaylistsTracksUseCase
+
+
+TRACKS = [
+    SpotifyTrack("spotify:track:1", "https://api.spotify.com/v1/tracks/1", "Blue (Da Ba Dee)", "ITT019810102",
+                 "Europop", 1999, "English", ["Eiffel 65"], ["eurodance"]),
+    SpotifyTrack("spotify:track:2", "https://api.spotify.com/v1/tracks/2", "Salir", "ES5020200101",
+                 "Yo, minoría absoluta", 2002, "Spanish", ["Extremoduro"], ["spanish rock"])
+]
 
 
 class MockSpotifyPort(object):
@@ -17,16 +29,36 @@ class MockSpotifyPort(object):
         return SpotifyUser("hombredeincognito", token_urlsafe(32))
 
 
+class MockGetLibraryUseCase(object):
+    def get_snapshot(self, spotify_user):
+        return LibrarySnapshot([t.uri for t in TRACKS], TRACKS)
+
+    def execute(self, spotify_user):
+        return TRACKS
+
+    def get_page(self, spotify_user, limit, cursor=None, snapshot=None):
+        snapshot = snapshot if snapshot is not None else self.get_snapshot(spotify_user)
+        positions, next_cursor = snapshot.page(limit, cursor)
+        return [TRACKS[i] for i in positions], next_cursor
+
+    def stream(self, spotify_user):
+        return iter(TRACKS)
+
+
 @pytest.fixture(scope="session")
 def client():
     def test_config(binder):
         spotify_gateway = MockSpotifyPort()
         repository = MemoryRepository()
+        get_library_use_case = MockGetLibraryUseCase()
         binder.bind(SpotifyGateway, spotify_gateway)
+        binder.bind(GetLibraryUseCase, get_library_use_case)
+        binder.bind(GetFilterPreviewUseCase, GetFilterPreviewUseCase(get_library_use_case))
         binder.bind(AddPlaylistUseCase, AddPlaylistUseCase(repository))
         binder.bind(GetPlaylistsUseCase, GetPlaylistsUseCase(repository))
         binder.bind(GetPlaylistUseCase, GetPlaylistUseCase(repository))
         binder.bind(RemovePlaylistUseCase, RemovePlaylistUseCase(repository))
+        binder.bind(GetPlaylistsTracksUseCase, GetPlaylistsTracksUseCase(repository, get_library_use_case))
 
     app = create_app(test_config)
     with app.test_client() as client:
@@ -43,6 +75,25 @@ def test_me(client):
     assert response.json == {'id': 'hombredeincognito'}
 
 
+def test_library(client):
+    response = client.get('/library')
+    assert response.json == {"tracks": [t.__dict__ for t in TRACKS]}
+
+    response = client.get('/library', headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.splitlines()] == [t.__dict__ for t in TRACKS]
+
+
+def test_filter_preview(client):
+    track_filter = {"$eq": {"language": "Spanish"}}
+    response = client.get('/filter_preview', json=track_filter)
+    assert response.json == {"track_filter": track_filter, "tracks": [TRACKS[1].__dict__]}
+
+    response = client.get('/filter_preview?stream=true', json=track_filter)
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.splitlines()] == [TRACKS[1].__dict__]
+
+
 def test_playlist(client):
     # TUNE: Here test are almost duplicating the ones defined in test_use_case.py
     playlist_invalid_dict = {
@@ -57,6 +108,9 @@ def test_playlist(client):
     response = client.post('/playlists', json=playlist_invalid_dict)
     assert response.status_code == 400
 
+    response = client.post('/playlists', json={"name": "a", "track_filter": {"$match": {"album": "(Veneno"}}})
+    assert response.status_code == 400
+
     response = client.get('/playlists')
     assert response.status_code == 200
     assert response.json == {"playlists": []}
@@ -93,4 +147,75 @@ def test_playlist(client):
 
     response = client.delete('/playlists/a')
     assert response.status_code == 200
-    assert response.json == playlist_response_dict
\ No newline at end of file
+    assert response.json == playlist_response_dict
+
+
+def test_playlists_tracks(client):
+    spanish_filter = {"$eq": {"language": "Spanish"}}
+    english_filter = {"$not": {"$eq": {"language": "Spanish"}}}
+    client.post('/playlists', json={"name": "spanish", "track_filter": spanish_filter})
+    client.post('/playlists', json={"name": "english", "track_filter": english_filter})
+
+    response = client.get('/playlists_tracks')
+    assert response.status_code == 200
+    assert response.json == {"playlists": [
+        {"name": "spanish", "track_filter": spanish_filter, "tracks": [TRACKS[1].__dict__]},
+        {"name": "english", "track_filter": english_filter, "tracks": [TRACKS[0].__dict__]}
+    ]}
+
+    client.delete('/playlists/spanish')
+    client.delete('/playlists/english')
+
+
+def test_conditional_requests(client, monkeypatch):
+    response = client.get('/library')
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    etag = response.headers["ETag"]
+    response = client.get('/library', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    track_filter = {"$eq": {"language": "Spanish"}}
+    response = client.get('/filter_preview', json=track_filter)
+    assert response.headers["ETag"] != etag
+    etag = response.headers["ETag"]
+    assert client.get('/filter_preview', json=track_filter, headers={"If-None-Match": etag}).status_code == 304
+    response = client.get('/filter_preview', json={"$eq": {"language": "English"}}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["tracks"] == [TRACKS[0].__dict__]
+
+    etag = client.get('/playlists').headers["ETag"]
+    with monkeypatch.context() as m:
+        # Playlists are not serialized for clients that already have them
+        m.setattr("ipodify_api.routes.dumps", None)
+        assert client.get('/playlists', headers={"If-None-Match": etag}).status_code == 304
+    client.post('/playlists', json={"name": "spanish", "track_filter": track_filter})
+    assert client.get('/playlists', headers={"If-None-Match": etag}).status_code == 200
+    etag = client.get('/playlists_tracks').headers["ETag"]
+    assert client.get('/playlists_tracks', headers={"If-None-Match": etag}).status_code == 304
+    client.delete('/playlists/spanish')
+    assert client.get('/playlists_tracks', headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_library_pages_and_fields(client):
+    response = client.get('/library?fields=uri')
+    assert response.json == {"tracks": [{"uri": t.uri} for t in TRACKS]}
+    response = client.get('/library?fields=uri,name&stream=true')
+    assert [json.loads(line) for line in response.data.splitlines()] == [{"uri": t.uri, "name": t.name} for t in TRACKS]
+    assert client.get('/library?fields=uri,label').status_code == 400
+
+    response = client.get('/library?limit=1&fields=uri')
+    assert response.json["tracks"] == [{"uri": TRACKS[0].uri}]
+    response = client.get(f'/library?limit=1&fields=uri&cursor={response.json["next_cursor"]}')
+    assert response.json == {"tracks": [{"uri": TRACKS[1].uri}], "next_cursor": None}
+    assert client.get('/library?limit=0').status_code == 400
+    assert client.get('/library?limit=a').status_code == 400
+    assert client.get('/library?limit=²').status_code == 400
+    assert client.get('/library?cursor=a').status_code == 400
+    assert client.get('/library?cursor=e30=').status_code == 400
+
+    track_filter = {"$eq": {"artists": "Extremoduro"}}
+    response = client.get('/filter_preview?limit=1&fields=name', json=track_filter)
+    assert response.json == {"track_filter": track_filter, "tracks": [{"name": "Salir"}], "next_cursor": None}
@@ -1,5 +1,24 @@
 # -*- coding: utf-8 -*-
 import pytest
 
+import builtins
 
-#def test_property_filters():
\ No newline at end of file
+from jsonschema import ValidationError
+
+from ipodify_api.schemas import validate_schema_data
+
+
+#def test_property_filters():
+
+
+def test_validate_schema_data(monkeypatch):
+    def not_open(*args, **kwargs):
+        raise AssertionError("Schemas must not be read when validating")
+
+    monkeypatch.setattr(builtins, "open", not_open)
+    validate_schema_data({"$and": [{"$eq": {"album": "Veneno"}}, {"$in": {"release_year": [2010, 2011]}}]}, "filter")
+    validate_schema_data({"name": "a", "track_filter": {"$not": {"$eq": {"album": "Veneno"}}}}, "playlist")
+    with pytest.raises(ValidationError):
+        validate_schema_data({"$and": [{"$equ": {"album": "Veneno"}}]}, "filter")
+    with pytest.raises(ValidationError):
+        validate_schema_data({"name": "a", "track_filter": {"$in": {"album": "Veneno"}}}, "playlist")
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import json
+
+from ipodify_api import serializers
+from ipodify_api.model.playlist import Playlist
+from ipodify_api.model.track import SpotifyTrack, TrackFilter
+from ipodify_api.model.user import User
+
+
+@pytest.fixture(params=["orjson", "json"])
+def dumps(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(serializers, "orjson", None)
+    elif serializers.orjson is None:
+        pytest.skip("orjson is not installed")
+    return serializers.dumps
+
+
+def test_dumps(dumps):
+    track = SpotifyTrack("spotify:track:1", "https://api.spotify.com/v1/tracks/1", "Esta noche", "ES5020200102",
+                         "Correos", 2011, "Spanish", ["Platero y Tú", "Extremoduro"], ["spanish rock"])
+    track_filter = TrackFilter.fromDict({"$and": [{"$eq": {"album": "Correos"}},
+                                                  {"$not": {"$lt": {"release_year": 2010}}}]})
+    user = User("a")
+    playlist = Playlist("b", user, track_filter)
+
+    assert json.loads(dumps({"tracks": [track]})) == {"tracks": [track.__dict__]}
+    assert json.loads(dumps(playlist)) == playlist.__dict__
+    assert json.loads(dumps([user, track_filter])) == [user.__dict__, track_filter.__dict__]
+    with pytest.raises(TypeError):
+        dumps({"set": {1}})
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
+import json
 import os
 import pytest
+import requests
+import threading
+import time
 
-from ipodify_api.model.playlist import Playlist
+from concurrent.futures import ThreadPoolExecutor
+
+from ipodify_api.cache import LRUCache, MetadataCache, LibrarySnapshotStore
+from ipodify_api.model.library import LibrarySnapshot
+from ipodify_api.model.playlist import Playlist, PlaylistContents
 from ipodify_api.model.user import User
 from ipodify_api.model.track import TrackFilter, SpotifyTrack
 
@@ -11,7 +19,7 @@ from ipodify_api.repositories.memory import MemoryRepository, filter_match
 from ipodify_api.gateways.spotify import SpotifyGateway, SpotifyUser
 
 from ipodify_api.use_cases import GetPlaylistsUseCase, AddPlaylistUseCase, GetPlaylistUseCase, RemovePlaylistUseCase, \
-                                  GetFilterPreviewUseCase, GetLibraryUseCase
+                                  GetFilterPreviewUseCase, GetLibraryUseCase, GetPlaylistsTracksUseCase
 
 
 # TODO: Replace this by pytest-datadir or pytest-datafiles
@@ -48,11 +56,16 @@ def test_playlist_use_cases(repository):
     filter_dict = {"$eq": {"album": "Veneno"}}
     playlist = Playlist(playlist_name, user, TrackFilter.fromDict(filter_dict))
 
+    empty_version = get_playlists.get_version(user_name)
     add_playlist.execute(playlist_name, user_name, filter_dict)
     assert get_playlists.execute(user_name) == [playlist]
+    version = get_playlists.get_version(user_name)
+    assert version != empty_version
+    assert get_playlists.get_version(user_name, [playlist]) == version
     assert get_playlist.execute(user_name, "b") == None
     remove_playlist.execute(user_name, playlist_name)
     assert get_playlists.execute(user_name) == []
+    assert get_playlists.get_version(user_name) == empty_version
 
 
 def test_get_library_use_case(spotify_user, requests_mock, content):
@@ -107,4 +120,264 @@ def test_get_preview_filter_use_case(spotify_user, requests_mock, content):
             "genres": ["bubblegum dance", "eurodance", "europop", "italian pop", "italo dance"]
         }
     )
-    assert not get_filter_preview.execute(spotify_user, {"$eq": {"album": "Jasmine"}})
\ No newline at end of file
+    assert not get_filter_preview.execute(spotify_user, {"$eq": {"album": "Jasmine"}})
+
+
+def test_get_library_use_case_incremental_refresh(spotify_user, requests_mock, content, tmp_path):
+    class SnapshotStore(LibrarySnapshotStore):
+        sets = 0
+
+        def set(self, *args):
+            self.sets += 1
+            super().set(*args)
+
+    spotify_url = "mock://spotify"
+    library = json.loads(content("get_library_tracks.json"))
+    albums = json.loads(content("get_library_albums.json"))
+    artists = json.loads(content("get_library_artists.json"))
+    old_library = dict(library, items=library["items"][1:], total=2)
+    requests_mock.get(f"{spotify_url}/v1/me/tracks", [
+        {"json": old_library, "headers": {"ETag": '"1"'}},
+        {"status_code": 304},
+        {"json": library, "headers": {"ETag": '"2"'}},
+        {"json": dict(library, items=library["items"][:2], total=2), "headers": {"ETag": '"3"'}}
+    ])
+    requests_mock.get(f"{spotify_url}/v1/albums?ids=0jvEFaPu8smfreB48YJBfB,4EUvdDfaYFFJtISsErAjuP",
+                      json={"albums": albums["albums"][1:]})
+    requests_mock.get(f"{spotify_url}/v1/artists?ids=5GiiOzSPyDaP5b4Bb7Moe2,10tYA1kHmiT7kCfF6HX0Wj",
+                      json={"artists": artists["artists"][2:]})
+    requests_mock.get(f"{spotify_url}/v1/albums?ids=54vbD17F1t5q3yHkj1cX37",
+                      json={"albums": albums["albums"][:1]})
+    requests_mock.get(f"{spotify_url}/v1/artists?ids=64rxQRJsLgZwHHyWKB8fiF,5ENS85nZShljwNgg4wFD7D",
+                      json={"artists": artists["artists"][:2]})
+    snapshot_store = SnapshotStore(str(tmp_path / "cache.db"))
+    get_user_library = GetLibraryUseCase(SpotifyGateway(spotify_url), LRUCache(100, weight=len), library_ttl=0,
+                                         snapshot_store=snapshot_store)
+
+    old_snapshot = get_user_library.get_snapshot(spotify_user)
+    assert len(old_snapshot) == 2
+    assert requests_mock.call_count == 3
+
+    not_modified_snapshot = get_user_library.get_snapshot(spotify_user)
+    assert requests_mock.last_request.headers["If-None-Match"] == '"1"'
+    assert not_modified_snapshot.version == old_snapshot.version
+    assert requests_mock.call_count == 4
+
+    snapshot = get_user_library.get_snapshot(spotify_user)
+    assert requests_mock.call_count == 7
+    assert snapshot.version != old_snapshot.version
+    assert snapshot.base_version == old_snapshot.version
+    assert snapshot.added_keys == (snapshot.keys[0],)
+    assert snapshot.removed_keys == ()
+    assert [t.uri for t in snapshot.tracks] == [i["track"]["uri"] for i in library["items"]]
+    assert snapshot.tracks[1:] == old_snapshot.tracks
+    assert snapshot.tracks[0].genres == ("bubblegum dance", "eurodance", "europop", "italian pop", "italo dance")
+
+    removed_snapshot = get_user_library.get_snapshot(spotify_user)
+    assert requests_mock.call_count == 8
+    assert removed_snapshot.base_version == snapshot.version
+    assert removed_snapshot.removed_keys == (snapshot.keys[2],)
+    assert removed_snapshot.tracks == snapshot.tracks[:2]
+
+    # Only the first snapshot is written whole, the rest only update the changes of the stored one
+    assert snapshot_store.sets == 1
+    version, etag, _, rows = snapshot_store.get(spotify_user.name)
+    assert (version, etag) == (removed_snapshot.version, '"3"')
+    assert [tuple(json.loads(k)) for k, _ in rows] == removed_snapshot.keys
+
+
+def test_get_library_use_case_shared_metadata(requests_mock, content):
+    spotify_url = "mock://spotify"
+    requests_mock.get(f"{spotify_url}/v1/me/tracks", text=content("get_library_tracks.json"))
+    requests_mock.get(
+        f"{spotify_url}/v1/albums?ids=54vbD17F1t5q3yHkj1cX37,0jvEFaPu8smfreB48YJBfB,4EUvdDfaYFFJtISsErAjuP",
+        text=content("get_library_albums.json"))
+    requests_mock.get(
+        f"{spotify_url}/v1/artists?ids=64rxQRJsLgZwHHyWKB8fiF,5ENS85nZShljwNgg4wFD7D,5GiiOzSPyDaP5b4Bb7Moe2,"
+        "10tYA1kHmiT7kCfF6HX0Wj",
+        text=content("get_library_artists.json"))
+    get_user_library = GetLibraryUseCase(SpotifyGateway(spotify_url), metadata_cache=MetadataCache())
+    tracks = get_user_library.execute(SpotifyUser("user1", "aaaaa"))
+    assert requests_mock.call_count == 3
+    assert [t.__dict__ for t in get_user_library.execute(SpotifyUser("user2", "bbbbb"))] == \
+        [t.__dict__ for t in tracks]
+    assert requests_mock.call_count == 4
+
+
+def test_stream_library_use_case(spotify_user, requests_mock, content):
+    spotify_url = "mock://spotify"
+    requests_mock.get(f"{spotify_url}/v1/me/tracks", text=content("get_library_tracks.json"))
+    requests_mock.get(f"{spotify_url}/v1/albums", text=content("get_library_albums.json"))
+    requests_mock.get(f"{spotify_url}/v1/artists", text=content("get_library_artists.json"))
+    library_cache = LRUCache(100, weight=len)
+    get_user_library = GetLibraryUseCase(SpotifyGateway(spotify_url), library_cache)
+    get_filter_preview = GetFilterPreviewUseCase(get_user_library)
+
+    tracks = get_user_library.stream(spotify_user, chunk_size=1)
+    assert next(tracks).uri == "spotify:track:2yAVzRiEQooPEJ9SYx11L3"
+    assert requests_mock.call_count == 3
+    assert [t.uri for t in tracks] == ["spotify:track:11xkwJxQka0XJlcyjeBydD", "spotify:track:3hrIaFk5GErZFhn97EoAAm"]
+    assert len(library_cache.get(spotify_user.name)) == 3
+
+    assert [t.album for t in get_filter_preview.stream(spotify_user, {"$eq": {"album": "Europop"}})] == ["Europop"]
+    assert requests_mock.call_count == 7
+
+    requests_mock.get(f"{spotify_url}/v1/me/tracks", status_code=503)
+    with pytest.raises(requests.HTTPError):
+        get_user_library.stream(SpotifyUser("user2", "bbbbb"))
+    with pytest.raises(requests.HTTPError):
+        get_filter_preview.stream(SpotifyUser("user2", "bbbbb"), {"$eq": {"album": "Europop"}})
+
+
+def test_get_playlists_tracks_use_case(spotify_user):
+    def track(uri, language):
+        return SpotifyTrack(uri, None, uri, None, "Album", 2000, language, ["Artist"], [])
+
+    class MockGetLibraryUseCase(object):
+        snapshot = None
+
+        def get_snapshot(self, spotify_user):
+            return self.snapshot
+
+    class NotUsableIndex(object):
+        def mask(self, track_filter, memo=None):
+            raise AssertionError("Library should not be evaluated")
+
+    repository = MemoryRepository()
+    get_library = MockGetLibraryUseCase()
+    get_playlists_tracks = GetPlaylistsTracksUseCase(repository, get_library)
+    add_playlist = AddPlaylistUseCase(repository)
+    add_playlist.execute("spanish", spotify_user.name, {"$eq": {"language": "Spanish"}})
+
+    tracks = [track("1", "Spanish"), track("2", "English"), track("3", "Spanish")]
+    get_library.snapshot = LibrarySnapshot(["1", "2", "3"], tracks)
+    [(playlist, playlist_tracks)] = get_playlists_tracks.execute(spotify_user)
+    assert playlist.name == "spanish"
+    assert playlist_tracks == [tracks[0], tracks[2]]
+
+    new_tracks = [track("4", "Spanish"), track("5", "English")] + tracks[1:]
+    get_library.snapshot = LibrarySnapshot(["4", "5", "2", "3"], new_tracks, index=NotUsableIndex(),
+                                           base_version=get_library.snapshot.version, added_keys=["4", "5"],
+                                           removed_keys=["1"])
+    assert get_playlists_tracks.execute(spotify_user) == [(playlist, [new_tracks[0], new_tracks[3]])]
+    assert repository.find_by_id(PlaylistContents, playlist.id).track_keys == {"4", "3"}
+    assert get_playlists_tracks.execute(spotify_user) == [(playlist, [new_tracks[0], new_tracks[3]])]
+
+    # Contents are updated with the changes of all the refreshes since they were materialized
+    snapshot = get_library.snapshot.changed(["6"] + get_library.snapshot.keys, [track("6", "Spanish")] + new_tracks,
+                                            None, ["6"])
+    snapshot = snapshot.changed(["7", "6", "4", "5", "2"], [track("7", "English")] + snapshot.tracks[:-1], None,
+                                ["7"], ["3"])
+    get_library.snapshot = LibrarySnapshot(snapshot.keys, snapshot.tracks, index=NotUsableIndex(),
+                                           deltas=snapshot.deltas)
+    assert [t.uri for _, tracks in get_playlists_tracks.execute(spotify_user) for t in tracks] == ["6", "4"]
+    new_tracks = snapshot.tracks
+
+    add_playlist.execute("spanish", spotify_user.name, {"$eq": {"language": "English"}})
+    assert not repository.contains_by_id(PlaylistContents, playlist.id)
+    get_library.snapshot = LibrarySnapshot(get_library.snapshot.keys, new_tracks)
+    assert get_playlists_tracks.execute(spotify_user) == [(playlist, [new_tracks[0], new_tracks[3], new_tracks[4]])]
+
+
+def test_get_library_use_case_warm_restart(spotify_user, requests_mock, content, tmp_path):
+    spotify_url = "mock://spotify"
+    requests_mock.get(f"{spotify_url}/v1/me/tracks", [
+        {"text": content("get_library_tracks.json"), "headers": {"ETag": '"1"'}},
+        {"status_code": 304}
+    ])
+    requests_mock.get(f"{spotify_url}/v1/albums", text=content("get_library_albums.json"))
+    requests_mock.get(f"{spotify_url}/v1/artists", text=content("get_library_artists.json"))
+    path = str(tmp_path / "cache.db")
+    tracks = GetLibraryUseCase(SpotifyGateway(spotify_url), LRUCache(100, weight=len),
+                               snapshot_store=LibrarySnapshotStore(path)).execute(spotify_user)
+    assert requests_mock.call_count == 3
+
+    get_user_library = GetLibraryUseCase(SpotifyGateway(spotify_url), LRUCache(100, weight=len),
+                                         snapshot_store=LibrarySnapshotStore(path))
+    assert [t.__dict__ for t in get_user_library.execute(spotify_user)] == [t.__dict__ for t in tracks]
+    assert requests_mock.call_count == 3
+
+    get_user_library = GetLibraryUseCase(SpotifyGateway(spotify_url), LRUCache(100, weight=len), library_ttl=0,
+                                         snapshot_store=LibrarySnapshotStore(path))
+    assert [t.__dict__ for t in get_user_library.execute(spotify_user)] == [t.__dict__ for t in tracks]
+    assert requests_mock.call_count == 4
+    assert requests_mock.last_request.headers["If-None-Match"] == '"1"'
+
+
+def test_get_library_use_case_single_flight(spotify_user, content):
+    library = json.loads(content("get_library_tracks.json"))
+
+    class MockSpotifyPort(object):
+        pages = 0
+        release = threading.Event()
+
+        def get_library_page(self, spotify_user, offset=0, limit=50, etag=None):
+            self.pages += 1
+            self.release.wait()
+            return library, '"1"'
+
+        def get_library_items(self, spotify_user, first_page=None):
+            return iter(first_page["items"])
+
+        def get_albums(self, spotify_user, ids):
+            return []
+
+        def get_artists(self, spotify_user, ids):
+            return []
+
+    spotify_port = MockSpotifyPort()
+    get_user_library = GetLibraryUseCase(spotify_port, LRUCache(100, weight=len))
+    with ThreadPoolExecutor(4) as executor:
+        results = [executor.submit(get_user_library.execute, spotify_user) for _ in range(4)]
+        time.sleep(0.1)
+        spotify_port.release.set()
+        tracks = [r.result() for r in results]
+    assert spotify_port.pages == 1
+    assert all(t is tracks[0] for t in tracks)
+    assert len(tracks[0]) == 3
+
+
+def test_stream_library_use_case_single_flight(spotify_user, content):
+    library = json.loads(content("get_library_tracks.json"))
+
+    class MockSpotifyPort(object):
+        pages = 0
+        release = threading.Event()
+
+        def get_library_page(self, spotify_user, offset=0, limit=50, etag=None):
+            self.pages += 1
+            return library, '"1"'
+
+        def get_library_items(self, spotify_user, first_page=None):
+            self.release.wait()
+            return iter(first_page["items"])
+
+        def get_albums(self, spotify_user, ids):
+            return []
+
+        def get_artists(self, spotify_user, ids):
+            return []
+
+    spotify_port = MockSpotifyPort()
+    get_user_library = GetLibraryUseCase(spotify_port)
+    with ThreadPoolExecutor(3) as executor:
+        tracks = get_user_library.stream(spotify_user)
+        results = [executor.submit(get_user_library.execute, spotify_user),
+                   executor.submit(lambda: list(get_user_library.stream(spotify_user)))]
+        time.sleep(0.1)
+        spotify_port.release.set()
+        tracks = list(tracks)
+        assert all(r.result() == tracks for r in results)
+    assert spotify_port.pages == 1
+    assert len(tracks) == 3
+
+    # Requests that wait for a stream that is closed before its end fetch the library again
+    spotify_port.release.clear()
+    with ThreadPoolExecutor(1) as executor:
+        tracks = get_user_library.stream(spotify_user)
+        result = executor.submit(get_user_library.execute, spotify_user)
+        time.sleep(0.1)
+        tracks.close()
+        spotify_port.release.set()
+        assert len(result.result()) == 3
+    assert spotify_port.pages == 3